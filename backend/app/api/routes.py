@@ -5,7 +5,7 @@ from app.services.enhanced_diagram_generator import generate_and_validate_diagra
 from app.services.storage import (
     save_architecture,
     load_architectures,
-    get_architecture,
+    get_architecture as get_saved_architecture,
     delete_architecture,
     upload_diagram,
     check_architecture_exists,
@@ -414,11 +414,8 @@ async def delete_arch(arch_id: str):
         if not arch_id or not arch_id.strip():
             raise HTTPException(status_code=400, detail="Architecture ID is required")
         
-        # Check if architecture exists before deletion
-        architectures = await load_architectures()
-        architecture_exists = any(arch["id"] == arch_id for arch in architectures)
-        
-        if not architecture_exists:
+        # Check if architecture exists before deletion (point read, not a listing)
+        if not await get_saved_architecture(arch_id):
             raise HTTPException(status_code=404, detail="Architecture not found")
         
         # Use async delete function
@@ -451,8 +448,7 @@ async def get_architecture(arch_id: str):
         if not arch_id or not arch_id.strip():
             raise HTTPException(status_code=400, detail="Architecture ID is required")
         
-        architectures = await load_architectures()
-        architecture = next((arch for arch in architectures if arch["id"] == arch_id), None)
+        architecture = await get_saved_architecture(arch_id)
         
         if not architecture:
             raise HTTPException(status_code=404, detail="Architecture not found")
@@ -1,14 +1,40 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.routes import router as api_router
 import os
+import logging
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI(title="ArchitectAI Backend")
+# Service modules log through the standard logging module; LOG_LEVEL controls verbosity
+logging.getLogger().setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create the RAG search clients once the worker is up rather than at import time
+    try:
+        from app.services.enhanced_microsoft_docs_service import get_enhanced_service
+        enhanced_docs_service = get_enhanced_service()
+        await enhanced_docs_service._ensure_ready()
+    except ImportError:
+        # Enhanced RAG dependencies missing; ai_agent falls back to the standard docs service
+        enhanced_docs_service = None
+    yield
+    # Release pooled MCP connections on shutdown
+    from app.services.diagram_generator_mcp_http import close_mcp_client
+    from app.services.microsoft_docs_service import microsoft_docs_service
+    from app.services.simple_mcp_validation import close_validation_client
+    await close_mcp_client()
+    await close_validation_client()
+    await microsoft_docs_service.aclose()
+    if enhanced_docs_service is not None:
+        await enhanced_docs_service.aclose()
+
+app = FastAPI(title="ArchitectAI Backend", lifespan=lifespan)
 
 # Add CORS middleware first
 app.add_middleware(
@@ -223,7 +223,8 @@ The PROJECT_ENDPOINT should look like: https://your-ai-foundry-project.services.
         try:
             # Try enhanced RAG service first, fallback to original
             try:
-                from .enhanced_microsoft_docs_service import enhanced_microsoft_docs_service
+                from .enhanced_microsoft_docs_service import get_enhanced_service
+                enhanced_microsoft_docs_service = get_enhanced_service()
                 use_enhanced = True
                 logger.info("🚀 Using enhanced RAG service")
             except ImportError:
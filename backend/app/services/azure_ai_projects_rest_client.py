@@ -220,13 +220,13 @@ class AzureAIProjectsRestClient:
             logger.error(f"Failed to create and process run: {e}")
             raise
     
-    async def list_messages(self, thread_id: str, order: str = "desc") -> List[Dict[str, Any]]:
+    async def list_messages(self, thread_id: str, order: str = "desc", limit: int = 20) -> List[Dict[str, Any]]:
         """List messages in a thread"""
         url = f"{self.endpoint}/threads/{thread_id}/messages"
         params = {
             "api-version": self.api_version,
             "order": order,
-            "limit": 20  # Reasonable limit
+            "limit": limit
         }
         
         try:
@@ -242,6 +242,23 @@ class AzureAIProjectsRestClient:
         except Exception as e:
             logger.error(f"Failed to list messages: {e}")
             return []
+    
+    async def delete_thread(self, thread_id: str) -> Dict[str, Any]:
+        """Delete a conversation thread"""
+        url = f"{self.endpoint}/threads/{thread_id}"
+        params = {"api-version": self.api_version}
+        
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.delete(url, headers=self.headers, params=params)
+                response.raise_for_status()
+                
+                logger.info(f"Deleted thread: {thread_id}")
+                return response.json()
+                
+        except Exception as e:
+            logger.error(f"Failed to delete thread: {e}")
+            raise
 
 
 # Remove the duplicate import
@@ -282,6 +299,10 @@ class ThreadsAdapter:
     def create(self):
         """Create a new thread"""
         return self.rest_client.create_thread()
+    
+    def delete(self, thread_id: str):
+        """Delete a thread"""
+        return self.rest_client.delete_thread(thread_id)
 
 
 class MessagesAdapter:
@@ -294,9 +315,9 @@ class MessagesAdapter:
         """Create a message"""
         return self.rest_client.create_message(thread_id, role, content)
     
-    def list(self, thread_id: str, order: str = "desc"):
+    def list(self, thread_id: str, order: str = "desc", limit: int = 20):
         """List messages"""
-        return self.rest_client.list_messages(thread_id, order)
+        return self.rest_client.list_messages(thread_id, order, limit)
 
 
 class RunsAdapter:
@@ -153,6 +153,37 @@ class AzureCosmosService:
             logger.error(f"Error listing from CosmosDB: {e}")
             return []
     
+    async def find_by_design(self, design_hash: str, design_document: str, user_id: str = "anonymous") -> Optional[Dict]:
+        """
+        Find a user's architecture with the given design document
+        Matches on the stored design hash; documents saved before it existed match on the full text
+        """
+        if not self.container:
+            return next(
+                (item for item in self._list_locally() if item.get("design_document") == design_document),
+                None
+            )
+        
+        try:
+            query = (
+                "SELECT TOP 1 * FROM c WHERE c.userId = @userId "
+                "AND (c.designHash = @designHash OR c.design_document = @designDocument)"
+            )
+            items = list(self.container.query_items(
+                query=query,
+                parameters=[
+                    {"name": "@userId", "value": user_id},
+                    {"name": "@designHash", "value": design_hash},
+                    {"name": "@designDocument", "value": design_document}
+                ],
+                partition_key=user_id
+            ))
+            return items[0] if items else None
+            
+        except AzureError as e:
+            logger.error(f"Error querying CosmosDB by design: {e}")
+            return None
+    
     async def update_architecture(self, architecture_id: str, architecture_data: Dict, user_id: str = "anonymous") -> bool:
         """
         Update architecture document in CosmosDB
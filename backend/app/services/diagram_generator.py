@@ -1,10 +1,17 @@
 import os
+import ast
 import uuid
 import logging
 import asyncio
 from dotenv import load_dotenv
 from .azure_credentials import get_azure_ai_projects_client
 
+# LLM output is arbitrary text; prefer the regex engine, which avoids re's backtracking cliffs
+try:
+    import regex as re
+except ImportError:
+    import re
+
 logger = logging.getLogger(__name__)
 load_dotenv()
 
@@ -15,6 +22,25 @@ AGENT_NAME = os.getenv("DIAGRAM_AGENT_NAME", "architectai-diagram-agent")
 _cached_agent_id = None
 _cached_client = None
 
+# Graphviz renders run in worker threads; cap how many run at once
+_render_sem = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_RENDERS", "4")))
+
+# Patterns used by validate_and_fix_imports, compiled once at import time
+_DIAGRAM_RE = re.compile(r'with Diagram\("([^"]+)"([^)]*)\):')
+_IMPORT_RE = re.compile(r'from diagrams\.azure\.(\w+) import ([\w, ]+)')
+
+# Specific module fixes (identity -> security, APIManagement web -> integration)
+_SPECIFIC_FIXES = {
+    'from diagrams.azure.identity import KeyVault': 'from diagrams.azure.security import KeyVaults as KeyVault',
+    'from diagrams.azure.identity import KeyVaults': 'from diagrams.azure.security import KeyVaults',
+    'from diagrams.azure.web import APIManagement': 'from diagrams.azure.integration import APIManagement',
+}
+# Longest keys first so "import KeyVaults" isn't matched as "import KeyVault"
+_SPECIFIC_RE = re.compile('|'.join(re.escape(key) for key in sorted(_SPECIFIC_FIXES, key=len, reverse=True)))
+
+_DIAGRAM_OPEN = 'with Diagram("'
+_DROPPED_DIAGRAM_PARAMS = ('filename=', 'outdir=')
+
 
 def get_diagram_agents_client():
     """
@@ -297,16 +323,16 @@ Output ONLY executable Python code. Do NOT return markdown or explanations."""
             last_error = run.get("last_error") if isinstance(run, dict) else getattr(run, "last_error", "Unknown error")
             raise Exception(f"Diagram agent failed: {last_error}")
 
-        # Get messages
-        messages_task = agents_client.messages.list(thread_id=thread_id, order="desc")
+        # Get only the newest message - the thread is single-use, so that is the assistant reply
+        messages_task = agents_client.messages.list(thread_id=thread_id, order="desc", limit=1)
         if asyncio.iscoroutine(messages_task):
             messages = await messages_task
+            message = messages[0] if messages else None
         else:
-            messages = list(messages_task)
+            message = next(iter(messages_task), None)
 
-        # Find the assistant's response
         code = None
-        for message in messages:
+        if message is not None:
             message_role = message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
             message_content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
             
@@ -320,25 +346,25 @@ Output ONLY executable Python code. Do NOT return markdown or explanations."""
                     combined_text = message_content
                 elif isinstance(message_content, list):
                     # Handle Azure AI response structure
+                    parts: list[str] = []
                     for item in message_content:
                         if isinstance(item, dict):
                             if item.get("type") == "text":
                                 text_obj = item.get("text", {})
                                 if isinstance(text_obj, dict) and "value" in text_obj:
-                                    combined_text += text_obj["value"]
+                                    parts.append(text_obj["value"])
                                 elif isinstance(text_obj, str):
-                                    combined_text += text_obj
+                                    parts.append(text_obj)
                         elif hasattr(item, 'type') and hasattr(item, 'text'):
                             if item.type == "text" and hasattr(item.text, 'value'):
-                                combined_text += item.text.value
+                                parts.append(item.text.value)
+                    combined_text = "".join(parts)
                 else:
                     logger.error(f"Unexpected message content type: {type(message_content)}")
-                    continue
 
                 if combined_text and combined_text.strip():
                     code = extract_code(combined_text)
                     logger.info(f"Successfully extracted diagram code ({len(code)} characters)")
-                    break
 
         if not code:
             raise Exception("No diagram code returned by assistant.")
@@ -365,7 +391,7 @@ async def generate_diagram(user_input: str) -> str:
         filepath = os.path.join("static", "diagrams", filename)
         
         # Pass the UUID to the render function so it can modify the diagram title
-        render_code_to_image(code, filepath, file_uuid)
+        await render_code_to_image_async(code, filepath, file_uuid)
 
         # Upload to Azure Storage if available
         try:
@@ -440,10 +466,37 @@ def extract_code(content: str) -> str:
     return ""
 
 
+async def render_code_to_image_async(code: str, filepath: str, file_uuid: str):
+    """Render diagram code in a worker thread so Graphviz doesn't block the event loop"""
+    async with _render_sem:
+        await asyncio.to_thread(render_code_to_image, code, filepath, file_uuid)
+
+
+def _target_diagram_file(tree: ast.Module, output_base: str):
+    """Point every Diagram(...) call in the parsed code at output_base with show=False"""
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        func_name = getattr(node.func, "id", None) or getattr(node.func, "attr", None)
+        if func_name != "Diagram":
+            continue
+        
+        filename_arg = ast.Constant(output_base)
+        if len(node.args) > 1:
+            # Diagram(name, filename, ...) - replace the positional filename
+            node.args[1] = filename_arg
+            node.keywords = [kw for kw in node.keywords if kw.arg not in ("outdir", "show")]
+        else:
+            node.keywords = [kw for kw in node.keywords if kw.arg not in ("filename", "outdir", "show")]
+            node.keywords.append(ast.keyword(arg="filename", value=filename_arg))
+        node.keywords.append(ast.keyword(arg="show", value=ast.Constant(False)))
+    
+    ast.fix_missing_locations(tree)
+
+
 def render_code_to_image(code: str, filepath: str, file_uuid: str):
     from diagrams import Diagram
     import os
-    import re
 
     try:
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
@@ -451,84 +504,44 @@ def render_code_to_image(code: str, filepath: str, file_uuid: str):
         # Comprehensive import validation and fixing
         fixed_code = validate_and_fix_imports(code)
         
-        # CRITICAL FIX: Replace the diagram title but keep it user-friendly
-        # The UUID is only used for the filename, not the display title
-        title_pattern = r'with Diagram\("([^"]+)"([^)]*)\):'
-        
-        def replace_title_keep_readable(match):
-            original_title = match.group(1)
-            params = match.group(2)
-            
-            # Keep the original title for display, but ensure the filename is UUID
-            # The filename will be handled separately by changing directory and using UUID
-            logger.debug(f"Keeping readable title '{original_title}' for display")
-            
-            # Ensure show=False is present to use UUID filename
-            if 'show=False' not in params:
-                if params.strip():
-                    return f'with Diagram("{original_title}"{params}, show=False):'
-                else:
-                    return f'with Diagram("{original_title}", show=False):'
-            else:
-                return f'with Diagram("{original_title}"{params}):'
-        
-        fixed_code = re.sub(title_pattern, replace_title_keep_readable, fixed_code)
-        
         logger.debug(f"Final code to execute:\n{fixed_code}")
         
-        # Set up the working directory for diagrams
-        original_cwd = os.getcwd()
-        output_dir = os.path.dirname(filepath)
+        # Keep the original title for display; the UUID is only used for the filename.
+        # Every Diagram writes straight to <output_dir>/<uuid>.png, so rendering never
+        # touches the process working directory and is safe to run in a worker thread.
+        tree = ast.parse(fixed_code, filename=filepath)
+        _target_diagram_file(tree, os.path.abspath(os.path.splitext(filepath)[0]))
+        
+        # Create a safe execution environment
+        exec_globals = {
+            "__file__": filepath,
+            "__name__": "__main__",
+            "Diagram": Diagram,
+        }
         
+        # Import all necessary diagrams modules
         try:
-            # Change to the output directory temporarily
-            os.chdir(output_dir)
+            import diagrams.azure.web
+            import diagrams.azure.security  
+            import diagrams.azure.database
+            import diagrams.azure.network
+            import diagrams.azure.storage
+            import diagrams.azure.compute
+            import diagrams.azure.general
             
-            # Create a safe execution environment
-            exec_globals = {
-                "__file__": filepath,
-                "__name__": "__main__",
-                "Diagram": Diagram,
-            }
-            
-            # Import all necessary diagrams modules
-            try:
-                import diagrams.azure.web
-                import diagrams.azure.security  
-                import diagrams.azure.database
-                import diagrams.azure.network
-                import diagrams.azure.storage
-                import diagrams.azure.compute
-                import diagrams.azure.general
-                
-                # Add modules to globals
-                exec_globals.update({
-                    'diagrams': diagrams,
-                })
-            except ImportError as e:
-                logger.warning(f"Could not import some diagrams modules: {e}")
-            
-            # Execute the fixed code (filename will be based on working directory)
-            exec(fixed_code, exec_globals)
-            
-            # After execution, find the created file and rename it to UUID
-            png_files = [f for f in os.listdir('.') if f.endswith('.png')]
-            if png_files:
-                # Get the most recently created PNG file
-                created_file = max(png_files, key=os.path.getctime)
-                expected_file = f"{file_uuid}.png"
-                
-                if created_file != expected_file:
-                    os.rename(created_file, expected_file)
-                    logger.info(f"Renamed '{created_file}' to '{expected_file}'")
-                else:
-                    logger.info(f"Diagram created as '{expected_file}'")
-            else:
-                raise Exception("No PNG file was created")
-                
-        finally:
-            # Always restore the original working directory
-            os.chdir(original_cwd)
+            # Add modules to globals
+            exec_globals.update({
+                'diagrams': diagrams,
+            })
+        except ImportError as e:
+            logger.warning(f"Could not import some diagrams modules: {e}")
+        
+        # Execute the fixed code
+        exec(compile(tree, filepath, "exec"), exec_globals)
+        
+        if not os.path.exists(filepath):
+            raise Exception("No PNG file was created")
+        logger.info(f"Diagram created as '{file_uuid}.png'")
         
     except Exception as e:
         logger.error(f"Error executing diagram code: {e}")
@@ -560,12 +573,51 @@ def render_code_to_image(code: str, filepath: str, file_uuid: str):
         raise RuntimeError(f"Failed to render diagram: {e}")
 
 
+def _fix_diagram_params(params: str) -> str:
+    """Drop filename/outdir arguments from a Diagram call and make sure show=False is set"""
+    # Clean up any existing filename/outdir params
+    params = ','.join(
+        param for param in params.split(',')
+        if not param.strip().startswith(_DROPPED_DIAGRAM_PARAMS)
+    )
+    
+    # Ensure show=False
+    if 'show=' not in params:
+        if params.strip() and not params.strip().endswith(','):
+            params += ', '
+        params += 'show=False'
+    
+    return params.lstrip(", ")
+
+def _rewrite_diagram_calls(code: str):
+    """
+    Rewrite every `with Diagram("title", ...):` header using plain string scanning.
+    Returns None if a header doesn't have the expected layout.
+    """
+    parts = []
+    pos = 0
+    idx = code.find(_DIAGRAM_OPEN)
+    while idx != -1:
+        title_start = idx + len(_DIAGRAM_OPEN)
+        title_end = code.find('"', title_start)
+        params_end = code.find(')', title_end + 1) if title_end > title_start else -1
+        if params_end == -1 or not code.startswith(':', params_end + 1):
+            return None
+        
+        title = code[title_start:title_end]
+        params = code[title_end + 1:params_end]
+        parts.append(code[pos:idx])
+        parts.append(f'with Diagram("{title}", {_fix_diagram_params(params)}):')
+        pos = params_end + 2
+        idx = code.find(_DIAGRAM_OPEN, pos)
+    
+    parts.append(code[pos:])
+    return ''.join(parts)
+
 def validate_and_fix_imports(code: str) -> str:
     """
     Validate and fix common import issues in diagrams code
     """
-    import re
-    
     # Define the correct mappings based on available imports
     AZURE_IMPORT_MAPPINGS = {
         # Web services
@@ -596,13 +648,6 @@ def validate_and_fix_imports(code: str) -> str:
     
     fixed_code = code
     
-    # First, handle specific module fixes (identity -> security, APIManagement web -> integration)
-    specific_fixes = {
-        'from diagrams.azure.identity import KeyVault': 'from diagrams.azure.security import KeyVaults as KeyVault',
-        'from diagrams.azure.identity import KeyVaults': 'from diagrams.azure.security import KeyVaults',
-        'from diagrams.azure.web import APIManagement': 'from diagrams.azure.integration import APIManagement',
-    }
-    
     # CRITICAL FIX: Handle APIManagement in mixed imports from web module
     if 'from diagrams.azure.web import' in fixed_code and 'APIManagement' in fixed_code:
         # Replace APIManagement from web imports and add correct import
@@ -624,46 +669,29 @@ def validate_and_fix_imports(code: str) -> str:
         if 'APIManagement(' in fixed_code:
             # Add import at the top if not already present
             if 'from diagrams.azure.integration import APIManagement' not in fixed_code:
-                import_lines = []
-                other_lines = []
-                for line in fixed_code.split('\n'):
-                    if line.strip().startswith('from diagrams'):
-                        import_lines.append(line)
-                    else:
-                        other_lines.append(line)
+                lines = fixed_code.split('\n')
+                import_lines = [line for line in lines if line.lstrip().startswith('from diagrams')]
+                other_lines = [line for line in lines if not line.lstrip().startswith('from diagrams')]
                 import_lines.append('from diagrams.azure.integration import APIManagement')
                 fixed_code = '\n'.join(import_lines + other_lines)
                 logger.debug("Added correct APIManagement import from integration module")
     
-    for incorrect, correct in specific_fixes.items():
-        if incorrect in fixed_code:
-            logger.debug(f"Applying specific fix: {incorrect} -> {correct}")
-            fixed_code = fixed_code.replace(incorrect, correct)
+    # Handle specific module fixes (identity -> security, APIManagement web -> integration) in one pass
+    if any(incorrect in fixed_code for incorrect in _SPECIFIC_FIXES):
+        fixed_code = _SPECIFIC_RE.sub(lambda match: _SPECIFIC_FIXES[match.group(0)], fixed_code)
     
     # Fix the Diagram constructor - just ensure show=False is present
-    diagram_pattern = r'with Diagram\("([^"]+)"([^)]*)\):'
-    
-    def fix_diagram_call(match):
-        title = match.group(1)
-        params = match.group(2)
-        
-        # Clean up any existing filename/outdir params
-        params = re.sub(r',?\s*filename=\w+', '', params)
-        params = re.sub(r',?\s*outdir=\w+', '', params)
-        
-        # Ensure show=False
-        if 'show=' not in params:
-            if params.strip() and not params.strip().endswith(','):
-                params += ', '
-            params += 'show=False'
-        
-        return f'with Diagram("{title}", {params.lstrip(", ")}):'
-    
-    fixed_code = re.sub(diagram_pattern, fix_diagram_call, fixed_code)
+    if _DIAGRAM_OPEN in fixed_code:
+        rewritten = _rewrite_diagram_calls(fixed_code)
+        if rewritten is None:
+            # Unusual layout, let the regex find whatever headers it can
+            rewritten = _DIAGRAM_RE.sub(
+                lambda match: f'with Diagram("{match.group(1)}", {_fix_diagram_params(match.group(2))}):',
+                fixed_code
+            )
+        fixed_code = rewritten
     
     # Now handle general import statement fixes (but skip ones already fixed by specific fixes)
-    import_pattern = r'from diagrams\.azure\.(\w+) import ([\w, ]+)'
-    
     def fix_import_line(match):
         module = match.group(1)  # e.g., 'web', 'security', etc.
         imports = match.group(2)  # e.g., 'AppService, KeyVault'
@@ -695,6 +723,7 @@ def validate_and_fix_imports(code: str) -> str:
     
     
     # Apply the fixes
-    fixed_code = re.sub(import_pattern, fix_import_line, fixed_code)
+    if 'from diagrams.azure.' in fixed_code:
+        fixed_code = _IMPORT_RE.sub(fix_import_line, fixed_code)
     
     return fixed_code
\ No newline at end of file
@@ -1,11 +1,18 @@
 import os
 import json
+import logging
+import time
+import asyncio
+import hashlib
 import httpx
-from typing import Dict, Any
+import orjson
+from collections import OrderedDict
+from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 from azure.ai.projects import AIProjectClient
 from .azure_credentials import get_credential_for_azure_ai_projects
 
+logger = logging.getLogger(__name__)
 load_dotenv()
 
 PROJECT_ENDPOINT = os.getenv("PROJECT_ENDPOINT")
@@ -20,31 +27,156 @@ DAPR_SERVICE_ID = "mcp-service"
 MCP_BASE_URL = f"http://localhost:{DAPR_PORT}/v1.0/invoke/{DAPR_SERVICE_ID}/method"
 # MCP_HTTP_SERVICE_URL = os.getenv("MCP_SERVICE_URL") or os.getenv("MCP_HTTP_SERVICE_URL", "http://localhost:8001")
 MCP_HTTP_TIMEOUT = int(os.getenv("MCP_HTTP_TIMEOUT", "60"))
+# Multiplex MCP calls over one HTTP/2 connection. The sidecar is plain http, so this uses
+# h2c with prior knowledge and must only be enabled when the sidecar accepts it.
+MCP_HTTP2 = os.getenv("MCP_HTTP2", "false").lower() == "true"
 
 _cached_agent_id = None
+_agent_lock = asyncio.Lock()
+
+# Remember a failed agent lookup briefly so a burst of callers doesn't retry it in lockstep
+_AGENT_RETRY_DELAY = 30.0
+_agent_failure: Optional[tuple[float, Exception]] = None
+
+# MCP health rarely flips within seconds, so reuse the last probe for a short while
+_HEALTH_TTL = 10.0
+_health_state = {"ok": False, "ts": 0.0}
+
+# Shared connection pool for all MCP calls (closed on app shutdown)
+_mcp_client: Optional[httpx.AsyncClient] = None
+
+async def get_mcp_client() -> httpx.AsyncClient:
+    """Return the shared MCP HTTP client, creating it on first use"""
+    global _mcp_client
+    
+    if _mcp_client is None or _mcp_client.is_closed:
+        _mcp_client = httpx.AsyncClient(
+            base_url=MCP_BASE_URL,
+            http1=not MCP_HTTP2,
+            http2=MCP_HTTP2,
+            # No pool timeout: long MCP calls shouldn't make queued requests fail early
+            timeout=httpx.Timeout(MCP_HTTP_TIMEOUT, connect=2.0, pool=None),
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+        )
+    return _mcp_client
+
+async def close_mcp_client():
+    """Close the shared MCP HTTP client"""
+    global _mcp_client
+    
+    if _mcp_client is not None:
+        await _mcp_client.aclose()
+        _mcp_client = None
+
+# Per-component validation cache: name -> (timestamp, validation result)
+_COMPONENT_TTL = 300
+_COMPONENT_CACHE_MAX = 1024
+_component_cache: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+
+# Deterministic tool outputs (suggestions, validated diagrams): hashed tool call -> (timestamp, result)
+MCP_TOOL_TTL = int(os.getenv("MCP_TOOL_TTL", "600"))
+_TOOL_CACHE_MAX = 256
+_tool_cache: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+
+def clear_component_cache():
+    """Drop all cached component validation results"""
+    _component_cache.clear()
+
+def clear_tool_cache():
+    """Drop all cached MCP tool outputs"""
+    _tool_cache.clear()
+
+def _cache_get(cache: OrderedDict, key: str, ttl: float) -> Optional[dict]:
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    
+    timestamp, result = entry
+    if time.monotonic() - timestamp > ttl:
+        del cache[key]
+        return None
+    
+    cache.move_to_end(key)
+    return result
+
+def _cache_put(cache: OrderedDict, key: str, result: dict, max_size: int):
+    cache[key] = (time.monotonic(), result)
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+def _tool_cache_key(name: str, arguments: Dict[str, Any]) -> str:
+    payload = orjson.dumps([name, arguments], option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def _extract_text(data: Dict[str, Any]) -> Optional[str]:
+    """Return the text payload of a successful MCP tool call response, or None"""
+    if not data.get("success"):
+        return None
+    
+    result = data.get("result") or {}
+    content = (result.get("result") or {}).get("content")
+    if not content:
+        return None
+    
+    first = content[0]
+    if isinstance(first, dict):
+        return first.get("text")
+    return getattr(first, "text", None)
+
+async def _post_tool(tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Call an MCP tool and decode its JSON text payload; raises on HTTP or payload errors"""
+    client = await get_mcp_client()
+    response = await client.post(
+        "/mcp/tools/call",
+        json={
+            "name": tool_name,
+            "arguments": arguments
+        }
+    )
+    response.raise_for_status()
+    
+    content = _extract_text(orjson.loads(response.content))
+    if content is None:
+        raise ValueError(f"MCP tool {tool_name} returned no content")
+    return orjson.loads(content)
 
 async def validate_components_via_mcp(component_names: list) -> Dict[str, Any]:
+    """Validate Azure component names using MCP HTTP service, reusing cached results"""
+    results = {}
+    missing = []
+    
+    for name in component_names:
+        cached = _cache_get(_component_cache, name, _COMPONENT_TTL)
+        if cached is None:
+            missing.append(name)
+        else:
+            results[name] = cached
+    
+    # Only ask MCP about names we have not seen recently
+    if missing:
+        fetched = await _fetch_component_validation(missing)
+        if fetched.get("error"):
+            return fetched
+        
+        for name, result in fetched.get("validation_results", {}).items():
+            _cache_put(_component_cache, name, result, _COMPONENT_CACHE_MAX)
+            results[name] = result
+    
+    return {
+        "validation_results": results,
+        "total_checked": len(component_names),
+        "valid_count": sum(1 for r in results.values() if r.get("valid")),
+        "invalid_count": sum(1 for r in results.values() if not r.get("valid"))
+    }
+
+async def _fetch_component_validation(component_names: list) -> Dict[str, Any]:
     """Validate Azure component names using MCP HTTP service"""
     try:
-        async with httpx.AsyncClient(timeout=MCP_HTTP_TIMEOUT) as client:
-            response = await client.post(
-                f"{MCP_BASE_URL}/mcp/tools/call",
-                json={
-                    "name": "validate_azure_components",
-                    "arguments": {
-                        "component_names": component_names
-                    }
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("success") and "result" in data:
-                    content = data["result"]["result"]["content"][0]["text"]
-                    return json.loads(content)
-            
-            return {"validation_results": {}, "error": f"HTTP {response.status_code}"}
-            
+        return await _post_tool("validate_azure_components", {"component_names": component_names})
+    except httpx.HTTPStatusError as e:
+        return {"validation_results": {}, "error": f"HTTP {e.response.status_code}"}
     except Exception as e:
         return {"validation_results": {}, "error": str(e)}
 
@@ -56,23 +188,23 @@ async def validate_import_statements_via_mcp(import_statements: list) -> Dict[st
         
         invalid_imports = []
         
+        # Validate every distinct component in one MCP round trip
+        unique_components = list(dict.fromkeys(stmt["component"] for stmt in import_statements))
+        bulk_result = await validate_components_via_mcp(unique_components) if unique_components else {}
+        validation_results = bulk_result.get("validation_results", {})
+        
         for stmt in import_statements:
             module = stmt["module"]
             component = stmt["component"] 
             full_import = stmt["full_import"]
             
-            # Validate the component exists
-            component_result = await validate_components_via_mcp([component])
-            
-            if component_result.get("error"):
+            if bulk_result.get("error"):
                 invalid_imports.append({
                     "original_import": full_import,
-                    "error": f"MCP service error: {component_result['error']}"
+                    "error": f"MCP service error: {bulk_result['error']}"
                 })
                 continue
             
-            validation_results = component_result.get("validation_results", {})
-            
             # Check if component is valid
             if component not in validation_results:
                 invalid_imports.append({
@@ -112,129 +244,140 @@ async def validate_import_statements_via_mcp(import_statements: list) -> Dict[st
 
 async def suggest_architecture_components_via_mcp(description: str, architecture_types: list = None) -> Dict[str, Any]:
     """Get architecture component suggestions using MCP HTTP service"""
+    arguments = {
+        "description": description,
+        "architecture_types": architecture_types or ["frontend", "backend", "database", "cache"]
+    }
+    cache_key = _tool_cache_key("suggest_architecture_components", arguments)
+    cached = _cache_get(_tool_cache, cache_key, MCP_TOOL_TTL)
+    if cached is not None:
+        return cached
+    
     try:
-        async with httpx.AsyncClient(timeout=MCP_HTTP_TIMEOUT) as client:
-            response = await client.post(
-                f"{MCP_BASE_URL}/mcp/tools/call",
-                json={
-                    "name": "suggest_architecture_components",
-                    "arguments": {
-                        "description": description,
-                        "architecture_types": architecture_types or ["frontend", "backend", "database", "cache"]
-                    }
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("success") and "result" in data:
-                    content = data["result"]["result"]["content"][0]["text"]
-                    return json.loads(content)
-            
-            return {"suggestions": [], "error": f"HTTP {response.status_code}"}
-            
+        result = await _post_tool("suggest_architecture_components", arguments)
+    except httpx.HTTPStatusError as e:
+        return {"suggestions": [], "error": f"HTTP {e.response.status_code}"}
     except Exception as e:
         return {"suggestions": [], "error": str(e)}
+    
+    _cache_put(_tool_cache, cache_key, result, _TOOL_CACHE_MAX)
+    return result
 
 async def generate_validated_diagram_via_mcp(description: str, provider: str = "azure", include_validation: bool = True) -> Dict[str, Any]:
     """Generate diagram with full validation using MCP HTTP service"""
+    arguments = {
+        "description": description,
+        "provider": provider,
+        "include_validation": include_validation
+    }
+    cache_key = _tool_cache_key("generate_validated_diagram", arguments)
+    cached = _cache_get(_tool_cache, cache_key, MCP_TOOL_TTL)
+    if cached is not None:
+        return cached
+    
     try:
-        async with httpx.AsyncClient(timeout=MCP_HTTP_TIMEOUT) as client:
-            response = await client.post(
-                f"{MCP_BASE_URL}/mcp/tools/call",
-                json={
-                    "name": "generate_validated_diagram",
-                    "arguments": {
-                        "description": description,
-                        "provider": provider,
-                        "include_validation": include_validation
-                    }
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("success") and "result" in data:
-                    content = data["result"]["result"]["content"][0]["text"]
-                    return json.loads(content)
-            
-            return {"success": False, "error": f"HTTP {response.status_code}"}
-            
+        result = await _post_tool("generate_validated_diagram", arguments)
+    except httpx.HTTPStatusError as e:
+        return {"success": False, "error": f"HTTP {e.response.status_code}"}
     except Exception as e:
         return {"success": False, "error": str(e)}
+    
+    # Failed generations aren't cached so a retry reaches MCP again
+    if result.get("success", True):
+        _cache_put(_tool_cache, cache_key, result, _TOOL_CACHE_MAX)
+    return result
 
 async def get_or_create_mcp_agent(client: AIProjectClient):
     """Get or create the MCP diagram agent"""
-    global _cached_agent_id
+    global _cached_agent_id, _agent_failure
     
     if _cached_agent_id:
         return _cached_agent_id
-        
-    try:
-        existing_agents = client.agents.list_agents()
-        for agent in existing_agents:
-            if agent.name == AGENT_NAME:
-                _cached_agent_id = agent.id
-                print(f"Found existing MCP agent: {agent.id}")
-                return agent.id
-    except Exception as e:
-        print(f"Error listing agents: {e}")
     
-    # Create new agent
-    try:
-        print(f"Creating new MCP agent: {AGENT_NAME}")
-        agent = client.agents.create_agent(
-            model=MODEL_NAME,
-            name=AGENT_NAME,
-            instructions=(
-                "You are an expert Azure architect and diagram generator. "
-                "Use the available MCP tools to create and analyze architecture diagrams. "
-                "Always provide detailed, professional responses with clear explanations."
-            ),
-            # No tools needed here - we'll call MCP directly
-        )
-        _cached_agent_id = agent.id
-        print(f"Created MCP agent: {agent.id}")
-        return agent.id
+    async with _agent_lock:
+        # Another caller may have resolved the agent while we were waiting
+        if _cached_agent_id:
+            return _cached_agent_id
         
-    except Exception as e:
-        print(f"Error creating MCP agent: {e}")
-        raise e
+        if _agent_failure and time.monotonic() - _agent_failure[0] < _AGENT_RETRY_DELAY:
+            raise _agent_failure[1]
+        
+        try:
+            existing_agents = client.agents.list_agents()
+            for agent in existing_agents:
+                if agent.name == AGENT_NAME:
+                    _cached_agent_id = agent.id
+                    _agent_failure = None
+                    logger.info("Found existing MCP agent: %s", agent.id)
+                    return agent.id
+        except Exception as e:
+            logger.warning("Error listing agents: %s", e)
+        
+        # Create new agent
+        try:
+            logger.info("Creating new MCP agent: %s", AGENT_NAME)
+            agent = client.agents.create_agent(
+                model=MODEL_NAME,
+                name=AGENT_NAME,
+                instructions=(
+                    "You are an expert Azure architect and diagram generator. "
+                    "Use the available MCP tools to create and analyze architecture diagrams. "
+                    "Always provide detailed, professional responses with clear explanations."
+                ),
+                # No tools needed here - we'll call MCP directly
+            )
+            _cached_agent_id = agent.id
+            _agent_failure = None
+            logger.info("Created MCP agent: %s", agent.id)
+            return agent.id
+            
+        except Exception as e:
+            logger.error("Error creating MCP agent: %s", e)
+            _agent_failure = (time.monotonic(), e)
+            raise e
 
 async def check_mcp_service_health():
-    """Check if MCP HTTP service is available"""
+    """Check if MCP HTTP service is available (cached for a few seconds)"""
+    now = time.monotonic()
+    if now - _health_state["ts"] < _HEALTH_TTL:
+        return _health_state["ok"]
+    
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{MCP_BASE_URL}/health")
-            return response.status_code == 200
+        client = await get_mcp_client()
+        response = await client.get("/health", timeout=5.0)
+        ok = response.status_code == 200
     except Exception:
-        return False
+        ok = False
+    
+    _health_state["ok"] = ok
+    _health_state["ts"] = time.monotonic()
+    return ok
 
 async def call_mcp_tool(tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Call an MCP tool via HTTP"""
     try:
-        async with httpx.AsyncClient(timeout=MCP_HTTP_TIMEOUT) as client:
-            response = await client.post(
-                f"{MCP_BASE_URL}/mcp/tools/call",
-                json={
-                    "name": tool_name,
-                    "arguments": arguments
-                }
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"MCP service error: {response.status_code} - {response.text}")
-            
-            result = response.json()
-            
-            if not result.get("success"):
-                error = result.get("error", "Unknown error")
-                raise Exception(f"MCP tool error: {error}")
-            
-            return result.get("result", {})
+        client = await get_mcp_client()
+        response = await client.post(
+            "/mcp/tools/call",
+            json={
+                "name": tool_name,
+                "arguments": arguments
+            }
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"MCP service error: {response.status_code} - {response.text}")
+        
+        result = orjson.loads(response.content)
+        
+        if not result.get("success"):
+            error = result.get("error", "Unknown error")
+            raise Exception(f"MCP tool error: {error}")
+        
+        return result.get("result", {})
             
     except Exception as e:
-        print(f"Error calling MCP tool {tool_name}: {e}")
+        logger.error("Error calling MCP tool %s: %s", tool_name, e)
         raise e
 
 async def generate_diagram_with_mcp_http(architecture_description: str) -> dict:
@@ -245,78 +388,78 @@ async def generate_diagram_with_mcp_http(architecture_description: str) -> dict:
         raise Exception("MCP HTTP service is not available. Please ensure the MCP wrapper is running.")
     
     try:
-        print("🔌 Using MCP HTTP service for diagram generation...")
+        logger.info("🔌 Using MCP HTTP service for diagram generation...")
         
         # Generate diagram using MCP HTTP service
-        print("🎨 Generating diagram with MCP...")
-        async with httpx.AsyncClient(timeout=MCP_HTTP_TIMEOUT) as client:
-            response = await client.post(
-                f"{MCP_BASE_URL}/mcp/generate-diagram",
-                json={
-                    "architecture_description": architecture_description
-                }
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"MCP diagram generation failed: {response.status_code} - {response.text}")
-            
-            result = response.json()
-            
-            if not result.get("success"):
-                error = result.get("error", "Unknown error")
-                raise Exception(f"MCP diagram generation error: {error}")
-            
-            mcp_result = result.get("result", {})
-            
-            # Extract the response content
-            if "result" in mcp_result and "content" in mcp_result["result"]:
-                content = mcp_result["result"]["content"]
-                if isinstance(content, list) and len(content) > 0:
-                    # Get the text content
-                    if hasattr(content[0], 'text'):
-                        response_text = content[0].text
-                    elif isinstance(content[0], dict) and "text" in content[0]:
-                        response_text = content[0]["text"]
-                    else:
-                        response_text = str(content[0])
+        logger.info("🎨 Generating diagram with MCP...")
+        client = await get_mcp_client()
+        response = await client.post(
+            "/mcp/generate-diagram",
+            json={
+                "architecture_description": architecture_description
+            }
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"MCP diagram generation failed: {response.status_code} - {response.text}")
+        
+        result = orjson.loads(response.content)
+        
+        if not result.get("success"):
+            error = result.get("error", "Unknown error")
+            raise Exception(f"MCP diagram generation error: {error}")
+        
+        mcp_result = result.get("result", {})
+        
+        # Extract the response content
+        if "result" in mcp_result and "content" in mcp_result["result"]:
+            content = mcp_result["result"]["content"]
+            if isinstance(content, list) and len(content) > 0:
+                # Get the text content
+                if hasattr(content[0], 'text'):
+                    response_text = content[0].text
+                elif isinstance(content[0], dict) and "text" in content[0]:
+                    response_text = content[0]["text"]
                 else:
-                    response_text = str(content)
-                
-                try:
-                    # Try to parse as JSON
-                    diagram_data = json.loads(response_text)
-                    
-                    # Ensure we have the required fields
-                    result = {
-                        "diagram_path": diagram_data.get("diagram_path", ""),
-                        "diagram_code": diagram_data.get("diagram_code", ""),
-                        "success": True,
-                        "explanation": diagram_data.get("explanation", "Diagram generated successfully"),
-                        "components_used": diagram_data.get("components_used", []),
-                        "suggestions": diagram_data.get("suggestions", [])
-                    }
-                    
-                    print(f"✅ MCP diagram generated: {result['diagram_path']}")
-                    return result
-                    
-                except json.JSONDecodeError:
-                    # If not JSON, treat as plain text explanation
-                    return {
-                        "diagram_path": "",
-                        "diagram_code": "",
-                        "success": False,
-                        "explanation": response_text,
-                        "error": "Failed to parse diagram response as JSON"
-                    }
+                    response_text = str(content[0])
             else:
+                response_text = str(content)
+            
+            try:
+                # Try to parse as JSON
+                diagram_data = orjson.loads(response_text)
+                
+                # Ensure we have the required fields
+                result = {
+                    "diagram_path": diagram_data.get("diagram_path", ""),
+                    "diagram_code": diagram_data.get("diagram_code", ""),
+                    "success": True,
+                    "explanation": diagram_data.get("explanation", "Diagram generated successfully"),
+                    "components_used": diagram_data.get("components_used", []),
+                    "suggestions": diagram_data.get("suggestions", [])
+                }
+                
+                logger.info("✅ MCP diagram generated: %s", result['diagram_path'])
+                return result
+                
+            except json.JSONDecodeError:
+                # If not JSON, treat as plain text explanation
                 return {
+                    "diagram_path": "",
+                    "diagram_code": "",
                     "success": False,
-                    "error": "Invalid response format from MCP service",
-                    "explanation": str(mcp_result)
+                    "explanation": response_text,
+                    "error": "Failed to parse diagram response as JSON"
                 }
+        else:
+            return {
+                "success": False,
+                "error": "Invalid response format from MCP service",
+                "explanation": str(mcp_result)
+            }
             
     except Exception as e:
-        print(f"Error in MCP HTTP diagram generation: {e}")
+        logger.error("Error in MCP HTTP diagram generation: %s", e)
         return {
             "success": False,
             "error": str(e),
@@ -330,29 +473,29 @@ async def analyze_architecture_with_mcp_http(diagram_code: str) -> dict:
         raise Exception("MCP HTTP service is not available")
     
     try:
-        print("🔍 Analyzing architecture with MCP HTTP service...")
+        logger.info("🔍 Analyzing architecture with MCP HTTP service...")
         
-        async with httpx.AsyncClient(timeout=MCP_HTTP_TIMEOUT) as client:
-            response = await client.post(
-                f"{MCP_BASE_URL}/mcp/analyze-architecture",
-                json={
-                    "diagram_code": diagram_code
-                }
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"MCP analysis failed: {response.status_code} - {response.text}")
-            
-            result = response.json()
-            
-            if not result.get("success"):
-                error = result.get("error", "Unknown error")
-                raise Exception(f"MCP analysis error: {error}")
-            
-            return result.get("result", {})
+        client = await get_mcp_client()
+        response = await client.post(
+            "/mcp/analyze-architecture",
+            json={
+                "diagram_code": diagram_code
+            }
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"MCP analysis failed: {response.status_code} - {response.text}")
+        
+        result = orjson.loads(response.content)
+        
+        if not result.get("success"):
+            error = result.get("error", "Unknown error")
+            raise Exception(f"MCP analysis error: {error}")
+        
+        return result.get("result", {})
             
     except Exception as e:
-        print(f"Error in MCP HTTP architecture analysis: {e}")
+        logger.error("Error in MCP HTTP architecture analysis: %s", e)
         raise e
 
 # Legacy compatibility - map old function names to new HTTP-based ones
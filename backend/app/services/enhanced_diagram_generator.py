@@ -1,15 +1,55 @@
 # Enhanced diagram generator with validation integration
 import os
+import uuid
 import asyncio
+import logging
+
+from .diagram_generator import generate_diagram_code, render_code_to_image_async
+from .storage import upload_diagram
+
+logger = logging.getLogger(__name__)
+
+_DIAGRAMS_DIR = os.path.join("static", "diagrams")
+
+# Skip MCP validation when code passes cheap local checks and renders cleanly
+DIAGRAM_LOCAL_FAST_PATH = os.getenv("DIAGRAM_LOCAL_FAST_PATH", "true").lower() == "true"
+
+# How long to keep waiting for MCP component suggestions once the diagram code is ready
+MCP_SUGGESTION_WAIT = float(os.getenv("MCP_SUGGESTION_WAIT", "2"))
+
+def is_obviously_valid(code: str) -> bool:
+    """Cheap structural checks: a Diagram block, balanced brackets and at least one Azure import"""
+    if not code or "with Diagram(" not in code or "from diagrams.azure." not in code:
+        return False
+    return all(code.count(open_) == code.count(close) for open_, close in ("()", "[]", "{}"))
 
 # Simple MCP-only validation - single source of truth
 async def validate_with_mcp_simple(architecture_description: str, diagram_code: str) -> dict:
     """Simple MCP validation - single source of truth, no local dependencies"""
     from .simple_mcp_validation import validate_and_fix_diagram_code_simple
     
-    print("🔌 Using MCP service as single source of truth...")
+    logger.info("🔌 Using MCP service as single source of truth...")
     return await validate_and_fix_diagram_code_simple(diagram_code, architecture_description)
 
+async def _upload_rendered_diagram(filepath: str, filename: str) -> str:
+    """Upload a rendered diagram to Azure Storage, falling back to the local static path"""
+    try:
+        diagram_url = await upload_diagram(filepath, filename)
+        
+        if diagram_url and diagram_url != filepath:
+            # Successfully uploaded to Azure Storage
+            logger.info("✅ Diagram uploaded to Azure Storage: %s", diagram_url)
+            return diagram_url
+        
+        # Fallback to local path
+        diagram_path = f"/static/diagrams/{filename}"
+        logger.warning("⚠️ Using local diagram path: %s", diagram_path)
+        return diagram_path
+        
+    except Exception as upload_error:
+        logger.warning("⚠️ Error uploading diagram to Azure Storage: %s", upload_error)
+        return f"/static/diagrams/{filename}"
+
 async def generate_and_validate_diagram(architecture_description: str, design_document: str = "") -> dict:
     """
     Generate diagram with validation loop
@@ -21,7 +61,8 @@ async def generate_and_validate_diagram(architecture_description: str, design_do
             'validation_results': dict,
             'final_code': str,
             'iterations': int,
-            'code': str (for compatibility)
+            'code': str (for compatibility),
+            'suggested_components': list (MCP component suggestions, on success)
         }
     """
     # Reduced iterations for faster response in production
@@ -30,87 +71,117 @@ async def generate_and_validate_diagram(architecture_description: str, design_do
     validation_results = {}
     last_error = None
     generated_code = None
+    suggested_components = []
     
-    # Import the diagram generator functions
-    from .diagram_generator import generate_diagram_code, render_code_to_image
-    import uuid
-    import os
+    from .diagram_generator_mcp_http import suggest_architecture_components_via_mcp
     
     while current_iteration < max_iterations:
         current_iteration += 1
-        print(f"\n🔄 Diagram Generation Iteration {current_iteration}/{max_iterations}")
+        logger.info("🔄 Diagram Generation Iteration %d/%d", current_iteration, max_iterations)
         
         try:
             # For first iteration, generate code from diagram agent
             if current_iteration == 1:
-                print("🎯 Generating diagram code from agent...")
-                generated_code = await generate_diagram_code(architecture_description)
-                print(f"📝 Generated code (first {200} chars): {generated_code[:200]}...")
+                logger.info("🎯 Generating diagram code from agent...")
+                # Ask MCP for component suggestions while the agent writes the code
+                suggest_task = asyncio.create_task(suggest_architecture_components_via_mcp(architecture_description))
+                try:
+                    generated_code = await generate_diagram_code(architecture_description)
+                except BaseException:
+                    suggest_task.cancel()
+                    raise
+                
+                # Suggestions are only informational, so a slow MCP service gets a short grace
+                # period rather than holding up the diagram (wait_for cancels it on timeout)
+                try:
+                    suggestions = await asyncio.wait_for(suggest_task, MCP_SUGGESTION_WAIT)
+                    suggested_components = [
+                        comp["canonical"] for comp in suggestions.get("components", [])
+                        if comp.get("canonical")
+                    ]
+                except asyncio.TimeoutError:
+                    logger.info("⏱️ MCP component suggestions not ready after %.1fs, skipping them", MCP_SUGGESTION_WAIT)
+                except Exception as suggest_error:
+                    logger.warning("⚠️ MCP component suggestions failed: %s", suggest_error)
+                
+                missing_components = [comp for comp in suggested_components if comp not in generated_code]
+                if missing_components:
+                    logger.info("💡 MCP suggested components not used in the diagram: %s", missing_components)
+                logger.debug("📝 Generated code (first 200 chars): %.200s...", generated_code)
             else:
                 # Use corrected code from previous validation
                 if validation_results.get('corrected_code'):
-                    print("🔧 Using corrected code from validation...")
+                    logger.info("🔧 Using corrected code from validation...")
                     generated_code = validation_results['corrected_code']
                 else:
-                    print("⚠️ No corrected code available, regenerating...")
+                    logger.warning("⚠️ No corrected code available, regenerating...")
                     generated_code = await generate_diagram_code(architecture_description)
             
             # Apply local fixes ONLY on first iteration and ONLY if no corrected code was provided
             if current_iteration == 1 and not validation_results.get('corrected_code'):
-                from .validation_agent import auto_fix_common_errors
-                locally_fixed_code = auto_fix_common_errors(generated_code)
-                if locally_fixed_code != generated_code:
-                    print("🔧 Applied local fixes to first iteration...")
-                    generated_code = locally_fixed_code
+                from .validation_agent import auto_fix_common_errors, needs_local_fixes
+                # Skip the regex-heavy pass when nothing obvious needs fixing; MCP validation follows anyway
+                if needs_local_fixes(generated_code):
+                    locally_fixed_code = auto_fix_common_errors(generated_code)
+                    if locally_fixed_code != generated_code:
+                        logger.info("🔧 Applied local fixes to first iteration...")
+                        generated_code = locally_fixed_code
+            
+            # A clean render proves every import resolved, so obviously valid code only
+            # goes to MCP if rendering fails
+            fast_path = DIAGRAM_LOCAL_FAST_PATH and is_obviously_valid(generated_code)
+            validate_task = None
+            if not fast_path:
+                # Start validating the code now so the MCP round trip overlaps the upload
+                logger.info("🔍 Validating generated diagram code...")
+                validate_task = asyncio.create_task(
+                    validate_with_mcp_simple(architecture_description, generated_code)
+                )
             
             # Now try to render the code
             try:
                 file_uuid = str(uuid.uuid4())
                 filename = f"{file_uuid}.png"
-                filepath = os.path.join("static", "diagrams", filename)
+                filepath = f"{_DIAGRAMS_DIR}/{filename}"
                 
-                print("🖼️ Rendering diagram...")
-                render_code_to_image(generated_code, filepath, file_uuid)
+                logger.info("🖼️ Rendering diagram...")
+                await render_code_to_image_async(generated_code, filepath, file_uuid)
                 
                 # Upload to Azure Storage if available
-                try:
-                    from .storage import upload_diagram
-                    diagram_url = await upload_diagram(filepath, filename)
-                    
-                    if diagram_url and diagram_url != filepath:
-                        # Successfully uploaded to Azure Storage
-                        print(f"✅ Diagram uploaded to Azure Storage: {diagram_url}")
-                        diagram_path = diagram_url
-                    else:
-                        # Fallback to local path
-                        diagram_path = f"/static/diagrams/{filename}"
-                        print(f"⚠️ Using local diagram path: {diagram_path}")
-                        
-                except Exception as upload_error:
-                    print(f"⚠️ Error uploading diagram to Azure Storage: {upload_error}")
-                    diagram_path = f"/static/diagrams/{filename}"
+                diagram_path = await _upload_rendered_diagram(filepath, filename)
                 
-                print(f"✅ Successfully rendered diagram: {diagram_path}")
+                logger.info("✅ Successfully rendered diagram: %s", diagram_path)
                 
             except Exception as render_error:
-                print(f"❌ Failed to render diagram: {render_error}")
+                logger.error("❌ Failed to render diagram: %s", render_error)
                 last_error = render_error
                 diagram_path = None
             
-            # Validate the generated diagram code
-            print("🔍 Validating generated diagram code...")
-            validation_results = await validate_with_mcp_simple(
-                architecture_description, 
-                generated_code
-            )
+            if fast_path and diagram_path:
+                logger.info("⚡ Code passed local checks and rendered cleanly, skipping MCP validation")
+                validation_results = {
+                    "is_valid": True,
+                    "validation_score": 100,
+                    "corrected_code": generated_code,
+                    "errors": [],
+                    "warnings": [],
+                    "suggestions": [],
+                    "explanation": "Passed local checks and rendered successfully",
+                    "skipped": "local-fast-path"
+                }
+            elif validate_task is None:
+                logger.info("🔍 Validating generated diagram code...")
+                validation_results = await validate_with_mcp_simple(architecture_description, generated_code)
+            else:
+                validation_results = await validate_task
             
-            print(f"📊 Validation Score: {validation_results['validation_score']}/100")
-            print(f"✅ Valid: {validation_results['is_valid']}")
+            logger.info("📊 Validation Score: %s/100", validation_results['validation_score'])
+            logger.info("✅ Valid: %s", validation_results['is_valid'])
             
             if validation_results['errors']:
-                print(f"🔧 Errors found: {validation_results['errors']}")
+                logger.info("🔧 Errors found: %s", validation_results['errors'])
             if validation_results['warnings']:
-                print(f"⚠️ Warnings: {validation_results['warnings']}")
+                logger.warning("⚠️ Warnings: %s", validation_results['warnings'])
                 
             # Check if we have a successful diagram - be more lenient about validation
             if diagram_path:
@@ -122,7 +193,7 @@ async def generate_and_validate_diagram(architecture_description: str, design_do
                 )
                 
                 if validation_acceptable:
-                    print(f"🎉 Diagram generated successfully in {current_iteration} iteration(s)!")
+                    logger.info("🎉 Diagram generated successfully in %d iteration(s)!", current_iteration)
                     final_code = validation_results.get('corrected_code', generated_code)
                     return {
                         'success': True,
@@ -130,40 +201,26 @@ async def generate_and_validate_diagram(architecture_description: str, design_do
                         'validation_results': validation_results,
                         'final_code': final_code,
                         'code': final_code,
-                        'iterations': current_iteration
+                        'iterations': current_iteration,
+                        'suggested_components': suggested_components
                     }
             
             if current_iteration == max_iterations:
-                print(f"⚠️ Max iterations reached.")
+                logger.warning("⚠️ Max iterations reached.")
                 # Try to use the corrected code one more time if available
                 final_code = validation_results.get('corrected_code', generated_code)
                 
                 if final_code and final_code != generated_code and not diagram_path:
-                    print("🔧 Attempting final render with corrected code...")
+                    logger.info("🔧 Attempting final render with corrected code...")
                     try:
                         file_uuid = str(uuid.uuid4())
                         filename = f"{file_uuid}.png"
-                        filepath = os.path.join("static", "diagrams", filename)
+                        filepath = f"{_DIAGRAMS_DIR}/{filename}"
                         
-                        render_code_to_image(final_code, filepath, file_uuid)
+                        await render_code_to_image_async(final_code, filepath, file_uuid)
                         
                         # Upload to Azure Storage if available
-                        try:
-                            from .storage import upload_diagram
-                            diagram_url = await upload_diagram(filepath, filename)
-                            
-                            if diagram_url and diagram_url != filepath:
-                                # Successfully uploaded to Azure Storage
-                                final_diagram_path = diagram_url
-                                print(f"✅ Final diagram uploaded to Azure Storage: {diagram_url}")
-                            else:
-                                # Fallback to local path
-                                final_diagram_path = f"/static/diagrams/{filename}"
-                                print(f"⚠️ Using local diagram path: {final_diagram_path}")
-                                
-                        except Exception as upload_error:
-                            print(f"⚠️ Error uploading final diagram to Azure Storage: {upload_error}")
-                            final_diagram_path = f"/static/diagrams/{filename}"
+                        final_diagram_path = await _upload_rendered_diagram(filepath, filename)
                         
                         return {
                             'success': True,
@@ -172,10 +229,11 @@ async def generate_and_validate_diagram(architecture_description: str, design_do
                             'final_code': final_code,
                             'code': final_code,
                             'iterations': current_iteration,
+                            'suggested_components': suggested_components,
                             'warning': 'Used corrected code from validation after max iterations'
                         }
                     except Exception as final_render_error:
-                        print(f"❌ Final render also failed: {final_render_error}")
+                        logger.error("❌ Final render also failed: %s", final_render_error)
                         last_error = final_render_error
                 
                 return {
@@ -187,11 +245,11 @@ async def generate_and_validate_diagram(architecture_description: str, design_do
                 }
             
             else:
-                print(f"🔧 Iteration {current_iteration} failed. Retrying with corrections...")
+                logger.info("🔧 Iteration %d failed. Retrying with corrections...", current_iteration)
                 # Continue to next iteration with validation feedback
                 
         except Exception as e:
-            print(f"❌ Error in iteration {current_iteration}: {e}")
+            logger.error("❌ Error in iteration %d: %s", current_iteration, e)
             last_error = e
             
             if current_iteration == max_iterations:
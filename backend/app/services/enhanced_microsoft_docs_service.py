@@ -3,14 +3,21 @@ Enhanced Microsoft Docs RAG Service with Azure AI Search Integration
 Implements hybrid search combining MCP live results with semantic embeddings
 """
 import asyncio
+import hashlib
+import heapq
 import logging
 import os
+import re
+from collections import OrderedDict
 from typing import List, Dict, Optional, Tuple
 import httpx
 import json
+import orjson
 import numpy as np
 from dataclasses import dataclass
+from operator import attrgetter, itemgetter
 from datetime import datetime
+from functools import cached_property, lru_cache
 
 # Azure AI Search imports
 try:
@@ -31,7 +38,31 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Query canonicalization for the embedding cache: punctuation/whitespace runs and articles
+# don't change what a docs query is about
+_NON_WORD_RE = re.compile(r"[\W_]+")
+_QUERY_STOPWORDS = frozenset({"a", "an", "the"})
+
+# Azure-specific terms appended to every enhanced query
+_AZURE_QUERY_TERMS = "Azure Microsoft cloud"
+
+# Field extraction for search results: defaults are merged in first so one C-level
+# itemgetter call replaces a chain of dict.get() lookups
+_SEMANTIC_DEFAULTS = {'title': '', 'content': '', 'url': '', 'category': 'general'}
+_get_semantic_fields = itemgetter('title', 'content', 'url', 'category')
+_MCP_DEFAULTS = {'title': '', 'content': '', 'contentUrl': ''}
+_get_mcp_fields = itemgetter('title', 'content', 'contentUrl')
+
+# Snippet length requested from MCP and upper bound on content kept per result
+MAX_SNIPPET_CHARS = 500
+MAX_DOC_CONTENT_CHARS = 1024
+
+def _canonical_query(text: str) -> str:
+    """Lowercase, strip punctuation, collapse whitespace and drop articles"""
+    words = _NON_WORD_RE.sub(" ", text.lower()).split()
+    return " ".join(word for word in words if word not in _QUERY_STOPWORDS)
+
+@dataclass(slots=True)
 class DocResult:
     """Structured document result with scoring"""
     title: str
@@ -40,6 +71,11 @@ class DocResult:
     category: str
     relevance_score: float
     source: str  # 'mcp' or 'semantic' or 'hybrid'
+    
+    def __post_init__(self):
+        # Only a short excerpt ever reaches the prompt; don't hold onto whole documents
+        if self.content and len(self.content) > MAX_DOC_CONTENT_CHARS:
+            self.content = self.content[:MAX_DOC_CONTENT_CHARS]
 
 class EnhancedMicrosoftDocsService:
     """Enhanced Microsoft Docs service with hybrid RAG capabilities"""
@@ -51,6 +87,10 @@ class EnhancedMicrosoftDocsService:
         self.mcp_base_url = f"http://localhost:{self.dapr_port}/v1.0/invoke/{self.dapr_service_id}/method"
         self.timeout = int(os.getenv("MCP_HTTP_TIMEOUT", "60"))
         
+        # Persistent MCP HTTP client, created on first use and closed on app shutdown
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_lock = asyncio.Lock()
+        
         # Azure AI Search configuration
         self.search_endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
         self.search_key = os.getenv("AZURE_SEARCH_KEY")
@@ -61,50 +101,91 @@ class EnhancedMicrosoftDocsService:
         self.azure_openai_key = os.getenv("AZURE_OPENAI_API_KEY")
         self.embedding_model = os.getenv("AZURE_OPENAI_EMBEDDING_MODEL", "text-embedding-ada-002")
         
-        # Initialize clients
-        self.search_client = None
-        self.openai_client = None
-        self._initialize_clients()
+        # In-process embedding cache (LRU) plus in-flight requests for single-flight lookups.
+        # Vectors are kept as float16 arrays: ~3 KiB each instead of ~50 KiB as a list of floats
+        self.embedding_cache_size = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+        self._emb_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._emb_inflight: Dict[bytes, asyncio.Task] = {}
+        
+        # Azure AI Search and OpenAI clients are created on first use (see the properties below)
         
         # RAG configuration
         self.max_mcp_results = 5
-        self.max_semantic_results = 10
         self.max_final_results = 8
         self.semantic_threshold = 0.75  # Minimum similarity score
+        # Optional server-side semantic ranker; the index must define this semantic configuration
+        self.semantic_config = os.getenv("AZURE_SEARCH_SEMANTIC_CONFIG")
+        self.reranker_threshold = 0.5  # Minimum rescaled reranker score (2.0 on the 0-4 scale)
+        # Per-source time budget so a slow MCP call can't hold back semantic results (or vice versa)
+        self.search_timeout = float(os.getenv("HYBRID_SEARCH_TIMEOUT", "3.0"))
         
-    def _initialize_clients(self):
-        """Initialize Azure AI Search and OpenAI clients"""
+    @cached_property
+    def search_client(self) -> Optional["SearchClient"]:
+        """Azure AI Search client, created on first use (None if not configured)"""
         try:
             if (AZURE_SEARCH_AVAILABLE and self.search_endpoint and self.search_key):
-                self.search_client = SearchClient(
+                client = SearchClient(
                     endpoint=self.search_endpoint,
                     index_name=self.search_index,
                     credential=AzureKeyCredential(self.search_key)
                 )
                 logger.info("✅ Azure AI Search client initialized")
-            else:
-                logger.warning("⚠️ Azure AI Search not available - using MCP only")
-                
+                return client
+            logger.warning("⚠️ Azure AI Search not available - using MCP only")
+        except Exception as e:
+            logger.error(f"❌ Failed to initialize Azure AI Search client: {e}")
+        return None
+
+    @cached_property
+    def openai_client(self) -> Optional["AsyncAzureOpenAI"]:
+        """Azure OpenAI client for embeddings, created on first use (None if not configured)"""
+        try:
             if (AZURE_OPENAI_AVAILABLE and self.azure_openai_endpoint and self.azure_openai_key):
-                self.openai_client = AsyncAzureOpenAI(
+                client = AsyncAzureOpenAI(
                     azure_endpoint=self.azure_openai_endpoint,
                     api_key=self.azure_openai_key,
                     api_version="2024-02-01"
                 )
                 logger.info("✅ Azure OpenAI client initialized")
-            else:
-                logger.warning("⚠️ Azure OpenAI not available - using MCP only")
-                
+                return client
+            logger.warning("⚠️ Azure OpenAI not available - using MCP only")
         except Exception as e:
-            logger.error(f"❌ Failed to initialize clients: {e}")
-            self.search_client = None
-            self.openai_client = None
+            logger.error(f"❌ Failed to initialize Azure OpenAI client: {e}")
+        return None
+
+    async def _ensure_ready(self):
+        """Create all clients up front, e.g. from the app lifespan once the worker is up"""
+        self.search_client
+        self.openai_client
+        await self._client()
+
+    @staticmethod
+    def _embedding_key(text: str) -> bytes:
+        """Cache key for a query: hash of its canonical form, so trivial variations share an entry"""
+        return hashlib.blake2b(_canonical_query(text).encode("utf-8"), digest_size=16).digest()
 
     async def generate_embedding(self, text: str) -> Optional[List[float]]:
-        """Generate embeddings for text using Azure OpenAI"""
+        """Generate embeddings for text using Azure OpenAI (cached, concurrent duplicates share one call)"""
         if not self.openai_client:
             return None
-            
+        
+        key = self._embedding_key(text)
+        cached = self._emb_cache.get(key)
+        if cached is not None:
+            self._emb_cache.move_to_end(key)
+            logger.debug("📊 Embedding cache hit")
+            return cached.astype(np.float32).tolist()
+        
+        task = self._emb_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._embed_and_cache(key, text))
+            self._emb_inflight[key] = task
+            task.add_done_callback(lambda _: self._emb_inflight.pop(key, None))
+        
+        # Shield so one cancelled caller doesn't cancel the request for everyone else
+        return await asyncio.shield(task)
+
+    async def _embed_and_cache(self, key: bytes, text: str) -> Optional[List[float]]:
         try:
             response = await self.openai_client.embeddings.create(
                 input=text,
@@ -112,11 +193,16 @@ class EnhancedMicrosoftDocsService:
             )
             embedding = response.data[0].embedding
             logger.debug(f"📊 Generated embedding with {len(embedding)} dimensions")
-            return embedding
             
         except Exception as e:
             logger.error(f"❌ Failed to generate embedding: {e}")
             return None
+        
+        self._emb_cache[key] = np.asarray(embedding, dtype=np.float16)
+        self._emb_cache.move_to_end(key)
+        while len(self._emb_cache) > self.embedding_cache_size:
+            self._emb_cache.popitem(last=False)
+        return embedding
 
     async def semantic_search(self, query: str, context: Dict) -> List[DocResult]:
         """Perform semantic search using Azure AI Search"""
@@ -130,36 +216,60 @@ class EnhancedMicrosoftDocsService:
             if not query_embedding:
                 return []
             
-            # Enhance query with context
-            enhanced_query = self._enhance_query(query, context)
-            
             # Perform vector search
+            # Oversample nearest neighbours for the hybrid fusion, but only page back as many
+            # documents as the final ranking can use
             vector_query = VectorizedQuery(
                 vector=query_embedding,
-                k_nearest_neighbors=self.max_semantic_results,
-                fields="content_vector"
+                k_nearest_neighbors=self.max_final_results * 2,
+                fields="content_vector",
+                exhaustive=False
             )
             
-            # Execute search with both vector and text
-            results = self.search_client.search(
-                search_text=enhanced_query,
-                vector_queries=[vector_query],
-                select=["title", "content", "url", "category", "architecture_types"],
-                top=self.max_semantic_results
-            )
+            if self.semantic_config:
+                # Hybrid query re-ranked by the service's semantic ranker; it handles recall
+                # itself, so the raw query is sent without context enrichment
+                results = self.search_client.search(
+                    search_text=query,
+                    vector_queries=[vector_query],
+                    query_type="semantic",
+                    semantic_configuration_name=self.semantic_config,
+                    query_caption="extractive",
+                    select=["title", "content", "url", "category", "architecture_types"],
+                    top=self.max_final_results
+                )
+            else:
+                # Enhance query with context
+                enhanced_query = self._enhance_query(query, context)
+                
+                # Execute search with both vector and text
+                results = self.search_client.search(
+                    search_text=enhanced_query,
+                    vector_queries=[vector_query],
+                    select=["title", "content", "url", "category", "architecture_types"],
+                    top=self.max_final_results
+                )
             
             # Convert to DocResult objects
             doc_results = []
             for result in results:
-                # Get search score (combination of vector similarity and text relevance)
-                score = result.get('@search.score', 0.0)
+                reranker_score = result.get('@search.reranker_score')
+                if reranker_score is not None:
+                    # Semantic ranker scores are calibrated on a 0-4 scale
+                    score = reranker_score / 4.0
+                    threshold = self.reranker_threshold
+                else:
+                    # Get search score (combination of vector similarity and text relevance)
+                    score = result.get('@search.score', 0.0)
+                    threshold = self.semantic_threshold
                 
-                if score >= self.semantic_threshold:
+                if score >= threshold:
+                    title, content, url, category = _get_semantic_fields({**_SEMANTIC_DEFAULTS, **result})
                     doc_results.append(DocResult(
-                        title=result.get('title', ''),
-                        content=result.get('content', ''),
-                        url=result.get('url', ''),
-                        category=result.get('category', 'general'),
+                        title=title,
+                        content=content,
+                        url=url,
+                        category=category,
                         relevance_score=score,
                         source='semantic'
                     ))
@@ -184,45 +294,65 @@ class EnhancedMicrosoftDocsService:
             enhanced_parts.extend(context['requirements'])
             
         # Add Azure-specific terms
-        enhanced_parts.extend(['Azure', 'Microsoft', 'cloud'])
+        enhanced_parts.append(_AZURE_QUERY_TERMS)
         
         enhanced_query = ' '.join(enhanced_parts)
         logger.debug(f"🔍 Enhanced query: {enhanced_query}")
         return enhanced_query
 
+    async def _client(self) -> httpx.AsyncClient:
+        """Return the shared MCP HTTP client, creating it on first use"""
+        if self._http is None or self._http.is_closed:
+            async with self._http_lock:
+                if self._http is None or self._http.is_closed:
+                    self._http = httpx.AsyncClient(
+                        timeout=self.timeout,
+                        http2=False,  # Dapr sidecar on localhost, nothing to negotiate
+                        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+                    )
+        return self._http
+
+    async def aclose(self):
+        """Close the shared MCP HTTP client"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
     async def mcp_search(self, query: str) -> List[DocResult]:
         """Perform MCP search (existing functionality)"""
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.mcp_base_url}/mcp/call_tool",
-                    json={
-                        "tool": "microsoft_docs_search",
-                        "arguments": {"query": query}
-                    }
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if isinstance(result, dict) and "content" in result:
-                        docs = result["content"][:self.max_mcp_results]
-                        
-                        # Convert to DocResult objects
-                        doc_results = []
-                        for doc in docs:
-                            if isinstance(doc, dict):
-                                doc_results.append(DocResult(
-                                    title=doc.get('title', ''),
-                                    content=doc.get('content', ''),
-                                    url=doc.get('contentUrl', ''),
-                                    category='mcp',
-                                    relevance_score=0.8,  # Default MCP score
-                                    source='mcp'
-                                ))
-                        
-                        logger.info(f"📡 MCP search found {len(doc_results)} docs")
-                        return doc_results
-                        
+            client = await self._client()
+            response = await client.post(
+                f"{self.mcp_base_url}/mcp/call_tool",
+                content=orjson.dumps({
+                    "tool": "microsoft_docs_search",
+                    "arguments": {"query": query, "max_snippet_chars": MAX_SNIPPET_CHARS}
+                }),
+                headers={"content-type": "application/json"}
+            )
+            
+            if response.status_code == 200:
+                result = orjson.loads(response.content)
+                if isinstance(result, dict) and "content" in result:
+                    docs = result["content"][:self.max_mcp_results]
+                    
+                    # Convert to DocResult objects
+                    doc_results = []
+                    for doc in docs:
+                        if isinstance(doc, dict):
+                            title, content, url = _get_mcp_fields({**_MCP_DEFAULTS, **doc})
+                            doc_results.append(DocResult(
+                                title=title,
+                                content=content,
+                                url=url,
+                                category='mcp',
+                                relevance_score=0.8,  # Default MCP score
+                                source='mcp'
+                            ))
+                    
+                    logger.info(f"📡 MCP search found {len(doc_results)} docs")
+                    return doc_results
+                    
         except Exception as e:
             logger.warning(f"⚠️ MCP search failed: {e}")
             
@@ -231,41 +361,47 @@ class EnhancedMicrosoftDocsService:
     def _merge_and_rank(self, mcp_results: List[DocResult], semantic_results: List[DocResult]) -> List[DocResult]:
         """Merge and rank results from different sources"""
         
-        # Combine results
-        all_results = []
-        seen_urls = set()
+        # At most max_mcp_results + max_final_results (13) candidates reach this point, so
+        # plain Python beats building NumPy arrays for the boosts and top-k selection
+        
+        # Combine results, deduplicating by URL
+        merged: Dict[str, DocResult] = {}
         
         # Add MCP results (prioritize live data)
         for result in mcp_results:
-            if result.url not in seen_urls:
+            if result.url not in merged:
                 result.relevance_score *= 1.2  # Boost MCP results (fresh data)
-                all_results.append(result)
-                seen_urls.add(result.url)
+                merged[result.url] = result
         
         # Add semantic results (deduplicate by URL)
         for result in semantic_results:
-            if result.url not in seen_urls:
-                all_results.append(result)
-                seen_urls.add(result.url)
+            existing = merged.get(result.url)
+            if existing is None:
+                merged[result.url] = result
             else:
                 # If same URL from different sources, boost the score
-                for existing in all_results:
-                    if existing.url == result.url:
-                        existing.relevance_score = max(existing.relevance_score, result.relevance_score * 1.1)
-                        existing.source = 'hybrid'
-                        break
+                existing.relevance_score = max(existing.relevance_score, result.relevance_score * 1.1)
+                existing.source = 'hybrid'
         
-        # Sort by relevance score (highest first)
-        ranked_results = sorted(all_results, key=lambda x: x.relevance_score, reverse=True)
-        
-        # Return top results
-        final_results = ranked_results[:self.max_final_results]
+        # Return top results by relevance score (highest first) without sorting everything
+        final_results = heapq.nlargest(self.max_final_results, merged.values(), key=attrgetter('relevance_score'))
         
         logger.info(f"🏆 Ranked results: {len(final_results)} final docs "
                    f"(MCP: {len(mcp_results)}, Semantic: {len(semantic_results)})")
         
         return final_results
 
+    async def _safe(self, label: str, search, *args) -> List[DocResult]:
+        """Run one search leg under the per-source timeout, returning [] on any failure"""
+        try:
+            async with asyncio.timeout(self.search_timeout):
+                return await search(*args)
+        except TimeoutError:
+            logger.warning(f"⏱️ {label} search timed out after {self.search_timeout}s")
+        except Exception as e:
+            logger.error(f"❌ {label} search exception: {e}", exc_info=True)
+        return []
+
     async def hybrid_search(self, query: str, context: Dict = None) -> List[Dict]:
         """Main hybrid search combining MCP and semantic search"""
         if context is None:
@@ -273,20 +409,11 @@ class EnhancedMicrosoftDocsService:
             
         logger.info(f"🔎 Starting hybrid search for: {query[:50]}...")
         
-        # Execute both searches concurrently
-        mcp_task = asyncio.create_task(self.mcp_search(query))
-        semantic_task = asyncio.create_task(self.semantic_search(query, context))
-        
-        # Wait for both to complete
-        mcp_results, semantic_results = await asyncio.gather(mcp_task, semantic_task, return_exceptions=True)
-        
-        # Handle exceptions
-        if isinstance(mcp_results, Exception):
-            logger.error(f"❌ MCP search exception: {mcp_results}")
-            mcp_results = []
-        if isinstance(semantic_results, Exception):
-            logger.error(f"❌ Semantic search exception: {semantic_results}")
-            semantic_results = []
+        # Execute both searches concurrently; each one fails (or times out) independently
+        async with asyncio.TaskGroup() as tg:
+            mcp_task = tg.create_task(self._safe("MCP", self.mcp_search, query))
+            semantic_task = tg.create_task(self._safe("Semantic", self.semantic_search, query, context))
+        mcp_results, semantic_results = mcp_task.result(), semantic_task.result()
         
         # Merge and rank results
         final_results = self._merge_and_rank(mcp_results, semantic_results)
@@ -306,5 +433,7 @@ class EnhancedMicrosoftDocsService:
         logger.info(f"✅ Hybrid search completed: {len(formatted_results)} results")
         return formatted_results
 
-# Global enhanced service instance
-enhanced_microsoft_docs_service = EnhancedMicrosoftDocsService()
\ No newline at end of file
+@lru_cache(maxsize=None)
+def get_enhanced_service() -> EnhancedMicrosoftDocsService:
+    """Shared enhanced service instance, constructed on first request rather than at import"""
+    return EnhancedMicrosoftDocsService()
\ No newline at end of file
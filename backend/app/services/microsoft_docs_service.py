@@ -2,14 +2,66 @@
 Microsoft Docs MCP Integration Service
 Provides real-time grounding with official Microsoft documentation
 """
+import asyncio
 import logging
 import os
-from typing import List, Dict, Optional
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
 import httpx
 import json
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# Snippet length requested from MCP; format_docs_for_prompt cuts content to this anyway
+MAX_SNIPPET_CHARS = 500
+
+# Curated Azure documentation knowledge base used when MCP is unavailable
+_AZURE_DOCS_KB = {
+    "multi-region": [
+        {
+            "title": "Azure Multi-Region Deployment Patterns",
+            "content": "Implement active-active or active-passive configurations across Azure regions. Use Azure Front Door for global load balancing and automatic failover. Configure cross-region database replication with Azure SQL geo-replication or Cosmos DB multi-region writes.",
+            "contentUrl": "https://learn.microsoft.com/en-us/azure/architecture/guide/design-principles/redundancy"
+        },
+        {
+            "title": "Azure Paired Regions for Disaster Recovery",
+            "content": "Each Azure region is paired with another region within the same geography. Paired regions provide automatic failover for platform services and coordinated updates. Design your DR strategy using paired regions for optimal recovery capabilities.",
+            "contentUrl": "https://learn.microsoft.com/en-us/azure/reliability/cross-region-replication-azure"
+        }
+    ],
+    "cost-optimization": [
+        {
+            "title": "Azure Reserved Instances and Savings Plans",
+            "content": "Save up to 72% with Azure Reserved Instances for compute resources. Use Azure Savings Plans for flexible cost optimization across compute services. Combine with Azure Hybrid Benefit for Windows Server and SQL Server licensing cost reductions.",
+            "contentUrl": "https://learn.microsoft.com/en-us/azure/cost-management-billing/reservations/save-compute-costs-reservations"
+        },
+        {
+            "title": "Azure Pricing Calculator and Cost Management",
+            "content": "Use the Azure Pricing Calculator to estimate costs before deployment. Set up budgets and alerts in Azure Cost Management. Monitor usage patterns and optimize resource allocation.",
+            "contentUrl": "https://learn.microsoft.com/en-us/azure/cost-management-billing/"
+        }
+    ],
+    "high-availability": [
+        {
+            "title": "Azure High Availability Architecture",
+            "content": "Design for 99.99% availability using Azure availability sets, zones, and regions. Implement health probes, auto-scaling, and failover mechanisms. Use Azure Load Balancer and Application Gateway for distribution.",
+            "contentUrl": "https://learn.microsoft.com/en-us/azure/architecture/guide/design-principles/redundancy"
+        }
+    ],
+    "security": [
+        {
+            "title": "Azure Security Best Practices",
+            "content": "Implement defense in depth with Azure Security Center, Key Vault for secrets management, and network security groups. Use Azure Active Directory for identity management and implement Zero Trust principles.",
+            "contentUrl": "https://learn.microsoft.com/en-us/azure/security/fundamentals/best-practices-and-patterns"
+        }
+    ]
+}
+
+# Category keywords, split once (e.g. "multi-region" -> ("multi", "region"))
+_FALLBACK_KEYWORDS = [(tuple(category.split('-')), docs) for category, docs in _AZURE_DOCS_KB.items()]
+
 class MicrosoftDocsService:
     """Service for integrating with Microsoft Docs MCP Server"""
     
@@ -19,6 +71,35 @@ class MicrosoftDocsService:
         self.mcp_base_url = f"http://localhost:{self.dapr_port}/v1.0/invoke/{self.dapr_service_id}/method"
         self.timeout = int(os.getenv("MCP_HTTP_TIMEOUT", "60"))
         self.max_results = 5  # Limit results for prompt efficiency
+        # Guidance lookups fan out several searches; cap how many hit MCP at once
+        self._search_semaphore = asyncio.Semaphore(4)
+        # Persistent MCP HTTP client, created on first use and closed on app shutdown
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_lock = asyncio.Lock()
+        # MCP docs change slowly and guidance queries recur, so successful searches are
+        # cached briefly; concurrent identical searches share one in-flight request
+        self.search_cache_ttl = int(os.getenv("DOCS_SEARCH_CACHE_TTL", "600"))
+        self.search_cache_size = 512
+        self._search_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._search_inflight: Dict[tuple, asyncio.Task] = {}
+    
+    async def _client(self) -> httpx.AsyncClient:
+        """Return the shared MCP HTTP client, creating it on first use"""
+        if self._http is None or self._http.is_closed:
+            async with self._http_lock:
+                if self._http is None or self._http.is_closed:
+                    self._http = httpx.AsyncClient(
+                        timeout=self.timeout,
+                        http2=False,  # Dapr sidecar on localhost, nothing to negotiate
+                        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+                    )
+        return self._http
+    
+    async def aclose(self):
+        """Close the shared MCP HTTP client"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
     
     async def search_azure_docs(self, query: str, max_results: Optional[int] = None) -> List[Dict]:
         """
@@ -33,98 +114,91 @@ class MicrosoftDocsService:
         """
         if max_results is None:
             max_results = self.max_results
-            
+        
+        key = (query, max_results)
+        entry = self._search_cache.get(key)
+        if entry is not None:
+            timestamp, docs = entry
+            if time.monotonic() - timestamp <= self.search_cache_ttl:
+                self._search_cache.move_to_end(key)
+                # Copy so callers can't mutate the cached snapshot
+                return [dict(doc) if isinstance(doc, dict) else doc for doc in docs]
+            del self._search_cache[key]
+        
+        task = self._search_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_azure_docs(query, max_results))
+            self._search_inflight[key] = task
+            task.add_done_callback(lambda _: self._search_inflight.pop(key, None))
+        
+        # Shield so one cancelled caller doesn't cancel the request for everyone else
+        docs, cacheable = await asyncio.shield(task)
+        if cacheable:
+            self._search_cache[key] = (time.monotonic(), docs)
+            self._search_cache.move_to_end(key)
+            while len(self._search_cache) > self.search_cache_size:
+                self._search_cache.popitem(last=False)
+        return [dict(doc) if isinstance(doc, dict) else doc for doc in docs]
+    
+    async def _fetch_azure_docs(self, query: str, max_results: int) -> Tuple[List[Dict], bool]:
+        """Query MCP for docs; returns (docs, from_mcp) so fallback results aren't cached"""
         try:
             # Try direct MCP integration first
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                # Call Microsoft Docs MCP Server through Dapr
-                response = await client.post(
-                    f"{self.mcp_base_url}/mcp/call_tool",
-                    json={
-                        "tool": "microsoft_docs_search",
-                        "arguments": {
-                            "query": query
-                        }
+            client = await self._client()
+            # Call Microsoft Docs MCP Server through Dapr
+            response = await client.post(
+                f"{self.mcp_base_url}/mcp/call_tool",
+                content=orjson.dumps({
+                    "tool": "microsoft_docs_search",
+                    "arguments": {
+                        "query": query,
+                        "max_snippet_chars": MAX_SNIPPET_CHARS
                     }
-                )
+                }),
+                headers={"content-type": "application/json"}
+            )
+            
+            if response.status_code == 200:
+                result = orjson.loads(response.content)
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    # Extract and limit results
-                    if isinstance(result, dict) and "content" in result:
-                        docs = result["content"]
-                        if isinstance(docs, list):
-                            # Limit results and ensure they're relevant
-                            limited_docs = docs[:max_results]
-                            logger.info(f"Found {len(limited_docs)} Azure docs for query: {query[:50]}...")
-                            return limited_docs
-                    
-                    logger.warning(f"Unexpected Microsoft Docs MCP response format: {result}")
+                # Extract and limit results
+                if isinstance(result, dict) and "content" in result:
+                    docs = result["content"]
+                    if isinstance(docs, list):
+                        # Limit results and ensure they're relevant
+                        limited_docs = docs[:max_results]
+                        logger.info(f"Found {len(limited_docs)} Azure docs for query: {query[:50]}...")
+                        return limited_docs, True
+                
+                logger.warning(f"Unexpected Microsoft Docs MCP response format: {result}")
                 
         except Exception as e:
             logger.warning(f"MCP service unavailable, using fallback: {e}")
         
         # Fallback: Use curated Azure documentation snippets
-        return self._get_fallback_docs(query, max_results)
+        return self._get_fallback_docs(query, max_results), False
+    
+    async def _bounded_search(self, query: str, max_results: Optional[int] = None) -> List[Dict]:
+        """search_azure_docs limited by the shared concurrency semaphore"""
+        async with self._search_semaphore:
+            return await self.search_azure_docs(query, max_results)
     
     def _get_fallback_docs(self, query: str, max_results: int) -> List[Dict]:
         """
         Fallback method with curated Azure documentation snippets
         """
-        # Curated Azure documentation knowledge base
-        azure_docs_kb = {
-            "multi-region": [
-                {
-                    "title": "Azure Multi-Region Deployment Patterns",
-                    "content": "Implement active-active or active-passive configurations across Azure regions. Use Azure Front Door for global load balancing and automatic failover. Configure cross-region database replication with Azure SQL geo-replication or Cosmos DB multi-region writes.",
-                    "contentUrl": "https://learn.microsoft.com/en-us/azure/architecture/guide/design-principles/redundancy"
-                },
-                {
-                    "title": "Azure Paired Regions for Disaster Recovery",
-                    "content": "Each Azure region is paired with another region within the same geography. Paired regions provide automatic failover for platform services and coordinated updates. Design your DR strategy using paired regions for optimal recovery capabilities.",
-                    "contentUrl": "https://learn.microsoft.com/en-us/azure/reliability/cross-region-replication-azure"
-                }
-            ],
-            "cost-optimization": [
-                {
-                    "title": "Azure Reserved Instances and Savings Plans",
-                    "content": "Save up to 72% with Azure Reserved Instances for compute resources. Use Azure Savings Plans for flexible cost optimization across compute services. Combine with Azure Hybrid Benefit for Windows Server and SQL Server licensing cost reductions.",
-                    "contentUrl": "https://learn.microsoft.com/en-us/azure/cost-management-billing/reservations/save-compute-costs-reservations"
-                },
-                {
-                    "title": "Azure Pricing Calculator and Cost Management",
-                    "content": "Use the Azure Pricing Calculator to estimate costs before deployment. Set up budgets and alerts in Azure Cost Management. Monitor usage patterns and optimize resource allocation.",
-                    "contentUrl": "https://learn.microsoft.com/en-us/azure/cost-management-billing/"
-                }
-            ],
-            "high-availability": [
-                {
-                    "title": "Azure High Availability Architecture",
-                    "content": "Design for 99.99% availability using Azure availability sets, zones, and regions. Implement health probes, auto-scaling, and failover mechanisms. Use Azure Load Balancer and Application Gateway for distribution.",
-                    "contentUrl": "https://learn.microsoft.com/en-us/azure/architecture/guide/design-principles/redundancy"
-                }
-            ],
-            "security": [
-                {
-                    "title": "Azure Security Best Practices",
-                    "content": "Implement defense in depth with Azure Security Center, Key Vault for secrets management, and network security groups. Use Azure Active Directory for identity management and implement Zero Trust principles.",
-                    "contentUrl": "https://learn.microsoft.com/en-us/azure/security/fundamentals/best-practices-and-patterns"
-                }
-            ]
-        }
-        
         # Search for relevant docs based on query keywords
         query_lower = query.lower()
-        relevant_docs = []
-        
-        for category, docs in azure_docs_kb.items():
-            if any(keyword in query_lower for keyword in category.split('-')):
-                relevant_docs.extend(docs)
+        relevant_docs = [
+            doc
+            for keywords, docs in _FALLBACK_KEYWORDS
+            if any(keyword in query_lower for keyword in keywords)
+            for doc in docs
+        ]
         
         # If no specific matches, return general architecture guidance
         if not relevant_docs:
-            relevant_docs = azure_docs_kb.get("high-availability", [])
+            relevant_docs = _AZURE_DOCS_KB.get("high-availability", [])
         
         # Limit results
         return relevant_docs[:max_results]
@@ -170,10 +244,17 @@ class MicrosoftDocsService:
             elif requirement.lower() in ["security", "compliance"]:
                 search_queries.append(f"Azure security {architecture_type} compliance")
         
-        # Execute searches and categorize results
-        for query in search_queries[:8]:  # Limit to avoid too many API calls
+        # Execute searches concurrently, then categorize results in query order
+        queries = search_queries[:8]  # Limit to avoid too many API calls
+        results = await asyncio.gather(
+            *(self._bounded_search(query, max_results=2) for query in queries),
+            return_exceptions=True
+        )
+        
+        for query, docs in zip(queries, results):
             try:
-                docs = await self.search_azure_docs(query, max_results=2)
+                if isinstance(docs, Exception):
+                    raise docs
                 
                 # Categorize based on query content
                 if "cost" in query.lower() or "optimization" in query.lower():
@@ -219,12 +300,19 @@ class MicrosoftDocsService:
         """
         service_docs = {}
         
-        for service in service_names[:10]:  # Limit services to avoid too many calls
+        services = service_names[:10]  # Limit services to avoid too many calls
+        results = await asyncio.gather(
+            *(
+                self._bounded_search(f"Azure {service} best practices configuration", max_results=2)
+                for service in services
+            ),
+            return_exceptions=True
+        )
+        
+        for service, docs in zip(services, results):
             try:
-                docs = await self.search_azure_docs(
-                    f"Azure {service} best practices configuration", 
-                    max_results=2
-                )
+                if isinstance(docs, Exception):
+                    raise docs
                 if docs:
                     service_docs[service] = docs
             except Exception as e:
@@ -10,27 +10,172 @@ import asyncio
 import json
 import os
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
+from dataclasses import dataclass
 from datetime import datetime
+from itertools import islice
 import hashlib
+import random
 import re
+import sqlite3
+from array import array
 from urllib.parse import urlparse, urljoin
 
 import httpx
+import orjson
 from openai import AsyncAzureOpenAI
 from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents import SearchClient
 from azure.search.documents.indexes.models import (
     SearchIndex, SearchField, SearchFieldDataType, VectorSearch,
     VectorSearchProfile, VectorSearchAlgorithmConfiguration,
-    HnswAlgorithmConfiguration, VectorSearchAlgorithmKind
+    HnswAlgorithmConfiguration, VectorSearchAlgorithmKind,
+    BinaryQuantizationCompression
 )
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# First URL in a search result's text
+_URL_RE = re.compile(r'https?://[^\s]+')
+
+# Hosts microsoft_docs_fetch can retrieve full content from
+_ALLOWED_HOSTS = frozenset({"learn.microsoft.com", "docs.microsoft.com", "azure.microsoft.com"})
+
+# Decimal places kept when uploading vectors to the float16 (Edm.Half) vector field
+_VECTOR_DECIMALS = 5
+
+# Search index schema
+_INDEX_FIELDS = [
+    # Primary key
+    SearchField(
+        name="id",
+        type=SearchFieldDataType.String,
+        key=True,
+        searchable=False,
+        filterable=True,
+        sortable=True
+    ),
+
+    # Document content and metadata
+    SearchField(
+        name="title",
+        type=SearchFieldDataType.String,
+        searchable=True,
+        filterable=True,
+        sortable=True
+    ),
+    SearchField(
+        name="content",
+        type=SearchFieldDataType.String,
+        searchable=True,
+        analyzer_name="en.microsoft"
+    ),
+    SearchField(
+        name="url",
+        type=SearchFieldDataType.String,
+        searchable=False,
+        filterable=True
+    ),
+    SearchField(
+        name="source_type",
+        type=SearchFieldDataType.String,
+        searchable=False,
+        filterable=True
+    ),
+    SearchField(
+        name="category",
+        type=SearchFieldDataType.String,
+        searchable=True,
+        filterable=True,
+        facetable=True
+    ),
+    SearchField(
+        name="last_updated",
+        type=SearchFieldDataType.DateTimeOffset,
+        searchable=False,
+        filterable=True,
+        sortable=True
+    ),
+    SearchField(
+        name="chunk_index",
+        type=SearchFieldDataType.Int32,
+        searchable=False,
+        filterable=True,
+        sortable=True
+    ),
+
+    # Vector field for embeddings
+    SearchField(
+        name="content_vector",
+        # float16 storage halves vector size; ranking is unaffected for unit-norm embeddings
+        type=SearchFieldDataType.Collection(SearchFieldDataType.Half),
+        searchable=True,
+        vector_search_dimensions=1536,  # text-embedding-3-small dimensions
+        vector_search_profile_name="my-vector-config"
+    )
+]
+
+# Vector search configuration
+_VECTOR_SEARCH = VectorSearch(
+    profiles=[
+        VectorSearchProfile(
+            name="my-vector-config",
+            algorithm_configuration_name="my-hnsw",
+            compression_name="my-bq"
+        )
+    ],
+    # Binary-quantized HNSW graph (32x smaller); candidates are rescored with
+    # the original full-precision vectors
+    compressions=[
+        BinaryQuantizationCompression(name="my-bq")
+    ],
+    algorithms=[
+        HnswAlgorithmConfiguration(
+            name="my-hnsw",
+            kind=VectorSearchAlgorithmKind.HNSW,
+            parameters={
+                "m": 4,
+                "efConstruction": 400,
+                "efSearch": 500,
+                "metric": "cosine"
+            }
+        )
+    ]
+)
+
+@dataclass(slots=True)
+class IndexedChunk:
+    """One chunk as stored in the search index (slotted: far smaller than a dict per chunk)"""
+    id: str
+    title: str
+    content: str
+    url: str
+    source_type: str
+    category: str
+    last_updated: str
+    chunk_index: int
+    content_vector: Optional[List[float]] = None
+    
+    def to_document(self) -> Dict[str, Any]:
+        """Search document for upload (shallow, unlike dataclasses.asdict which copies the vector)"""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+# URL path segment -> category, in precedence order
+_CATEGORY_SEGMENTS = (
+    ("azure", "azure"),
+    ("dotnet", "dotnet"),
+    ("microsoft-365", "microsoft-365"),
+    ("power-platform", "power-platform"),
+    ("windows", "windows"),
+)
+
+# Characters chunk_document prefers to break after
+_SENTENCE_ENDINGS = ('.', '!', '?', '\n')
+
 class MicrosoftLearnIndexer:
     """Service to index Microsoft Learn documentation with embeddings for semantic search"""
     
@@ -53,10 +198,34 @@ class MicrosoftLearnIndexer:
         # Initialize clients
         self._init_clients()
         
+        # Pooled MCP client reused across fetches. HTTP/2 multiplexes the concurrent requests
+        # when the MCP URL is https; a plain-http URL simply stays on HTTP/1.1
+        # (pool settings go on the transport; httpx ignores client-level ones when one is given)
+        self.http_client = httpx.AsyncClient(
+            timeout=60.0,
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                retries=2  # Retries failed connection attempts, not HTTP errors
+            )
+        )
+        
         # Document processing configuration
         self.chunk_size = 1000  # Characters per chunk
         self.chunk_overlap = 200  # Overlap between chunks
         self.max_docs_per_batch = 10  # Documents to process in parallel
+        self.embedding_batch_size = 50  # Azure OpenAI embedding batch limit
+        self.max_concurrent_embedding_batches = 8  # Embedding requests in flight at once
+        self.max_concurrent_queries = 10  # MCP search queries in flight at once
+        self.max_concurrent_uploads = 4  # Search upload batches in flight at once
+        
+        # Persistent chunk embedding cache so re-runs only embed new or changed content
+        self.embedding_cache_path = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite")
+        self._embedding_cache: Optional[sqlite3.Connection] = None
+        # Chunks whose content hash matches their last successful upload to this index are
+        # skipped (an empty index uploads everything); set INDEXER_FORCE_UPLOAD=true after
+        # documents have been deleted from or edited in the index elsewhere
+        self.force_upload = os.getenv("INDEXER_FORCE_UPLOAD", "false").lower() == "true"
         
     def _init_clients(self):
         """Initialize Azure OpenAI and Search clients"""
@@ -92,108 +261,23 @@ class MicrosoftLearnIndexer:
             logger.error(f"❌ Failed to initialize clients: {e}")
             raise
     
+    async def aclose(self):
+        """Close the pooled MCP client and the embedding cache database"""
+        await self.http_client.aclose()
+        if self._embedding_cache is not None:
+            self._embedding_cache.close()
+            self._embedding_cache = None
+    
     async def create_search_index(self) -> bool:
         """Create the Azure AI Search index with vector fields"""
         try:
             logger.info(f"🔧 Creating search index: {self.search_index_name}")
             
-            # Define the search index schema
-            fields = [
-                # Primary key
-                SearchField(
-                    name="id",
-                    type=SearchFieldDataType.String,
-                    key=True,
-                    searchable=False,
-                    filterable=True,
-                    sortable=True
-                ),
-                
-                # Document content and metadata
-                SearchField(
-                    name="title",
-                    type=SearchFieldDataType.String,
-                    searchable=True,
-                    filterable=True,
-                    sortable=True
-                ),
-                SearchField(
-                    name="content",
-                    type=SearchFieldDataType.String,
-                    searchable=True,
-                    analyzer_name="en.microsoft"
-                ),
-                SearchField(
-                    name="url",
-                    type=SearchFieldDataType.String,
-                    searchable=False,
-                    filterable=True
-                ),
-                SearchField(
-                    name="source_type",
-                    type=SearchFieldDataType.String,
-                    searchable=False,
-                    filterable=True
-                ),
-                SearchField(
-                    name="category",
-                    type=SearchFieldDataType.String,
-                    searchable=True,
-                    filterable=True,
-                    facetable=True
-                ),
-                SearchField(
-                    name="last_updated",
-                    type=SearchFieldDataType.DateTimeOffset,
-                    searchable=False,
-                    filterable=True,
-                    sortable=True
-                ),
-                SearchField(
-                    name="chunk_index",
-                    type=SearchFieldDataType.Int32,
-                    searchable=False,
-                    filterable=True,
-                    sortable=True
-                ),
-                
-                # Vector field for embeddings
-                SearchField(
-                    name="content_vector",
-                    type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-                    searchable=True,
-                    vector_search_dimensions=1536,  # text-embedding-3-small dimensions
-                    vector_search_profile_name="my-vector-config"
-                )
-            ]
-            
-            # Configure vector search
-            vector_search = VectorSearch(
-                profiles=[
-                    VectorSearchProfile(
-                        name="my-vector-config",
-                        algorithm_configuration_name="my-hnsw"
-                    )
-                ],
-                algorithms=[
-                    HnswAlgorithmConfiguration(
-                        name="my-hnsw",
-                        kind=VectorSearchAlgorithmKind.HNSW,
-                        parameters={
-                            "m": 4,
-                            "efConstruction": 400,
-                            "efSearch": 500,
-                            "metric": "cosine"
-                        }
-                    )
-                ]
-            )
-            
             # Create the index
             index = SearchIndex(
                 name=self.search_index_name,
-                fields=fields,
-                vector_search=vector_search
+                fields=_INDEX_FIELDS,
+                vector_search=_VECTOR_SEARCH
             )
             
             # Create or update the index
@@ -210,85 +294,35 @@ class MicrosoftLearnIndexer:
         documents = []
         
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                for query in queries:
-                    logger.info(f"🔍 Fetching docs for query: '{query}'")
-                    
-                    # Use MCP microsoft_docs_search to find relevant documents
-                    search_response = await client.post(
-                        f"{self.mcp_base_url}/mcp/call_tool",
-                        json={
-                            "name": "microsoft_docs_search",
-                            "arguments": {"query": query}
-                        }
-                    )
-                    
-                    if search_response.status_code == 200:
-                        search_data = search_response.json()
-                        
-                        # Extract search results
-                        if "result" in search_data and "content" in search_data["result"]:
-                            content = search_data["result"]["content"]
-                            if isinstance(content, list):
-                                for item in content[:10]:  # Limit per query
-                                    if isinstance(item, dict) and "text" in item:
-                                        doc_text = item["text"]
-                                        
-                                        # Extract URL if available
-                                        url_match = re.search(r'https?://[^\s]+', doc_text)
-                                        doc_url = url_match.group(0) if url_match else None
-                                        
-                                        # Extract title (usually first line)
-                                        lines = doc_text.strip().split('\n')
-                                        title = lines[0][:100] if lines else f"Document for {query}"
-                                        
-                                        documents.append({
-                                            "title": title.strip(),
-                                            "content": doc_text,
-                                            "url": doc_url,
-                                            "source_query": query,
-                                            "source_type": "microsoft_learn_search"
-                                        })
-                    
-                    # If we have URLs, try to fetch full content
-                    if len(documents) < max_docs:
-                        # Extract unique URLs from the documents we found
-                        unique_urls = set()
-                        for doc in documents:
-                            if doc.get("url"):
-                                unique_urls.add(doc["url"])
-                        
-                        # Fetch full content for some URLs using microsoft_docs_fetch
-                        for url in list(unique_urls)[:5]:  # Limit to 5 full fetches per query
-                            if url and "microsoft.com" in url:
-                                try:
-                                    fetch_response = await client.post(
-                                        f"{self.mcp_base_url}/mcp/call_tool",
-                                        json={
-                                            "name": "microsoft_docs_fetch",
-                                            "arguments": {"url": url}
-                                        }
-                                    )
-                                    
-                                    if fetch_response.status_code == 200:
-                                        fetch_data = fetch_response.json()
-                                        if "result" in fetch_data and "content" in fetch_data["result"]:
-                                            full_content = fetch_data["result"]["content"]
-                                            if isinstance(full_content, list) and len(full_content) > 0:
-                                                content_text = full_content[0].get("text", "")
-                                                if len(content_text) > 500:  # Only if substantial content
-                                                    documents.append({
-                                                        "title": f"Full content: {url.split('/')[-1]}",
-                                                        "content": content_text,
-                                                        "url": url,
-                                                        "source_query": query,
-                                                        "source_type": "microsoft_learn_full"
-                                                    })
-                                except Exception as fetch_error:
-                                    logger.warning(f"⚠️ Failed to fetch full content from {url}: {fetch_error}")
-                    
-                    if len(documents) >= max_docs:
-                        break
+            client = self.http_client
+            
+            # Queries run in concurrent waves and results are concatenated in query order; as in
+            # a sequential loop, nothing more is searched or fetched once max_docs is reached
+            for start in range(0, len(queries), self.max_concurrent_queries):
+                wave = queries[start:start + self.max_concurrent_queries]
+                results = await asyncio.gather(*(self._search_query(client, query) for query in wave), return_exceptions=True)
+                
+                # Full content is only fetched for queries still short of max_docs, counting
+                # what earlier queries in the wave are expected to add
+                expected = len(documents)
+                wave_docs = []
+                fetches = []
+                for query, query_docs in zip(wave, results):
+                    if isinstance(query_docs, Exception):
+                        logger.error(f"❌ Error fetching Microsoft docs for '{query}': {query_docs}")
+                        continue
+                    expected += len(query_docs)
+                    fetch_urls = self._full_content_urls(query_docs) if expected < max_docs else []
+                    expected += len(fetch_urls)
+                    wave_docs.append(query_docs)
+                    fetches.append(asyncio.gather(*(self._fetch_full_content(client, url, query) for url in fetch_urls)))
+                
+                for query_docs, full_docs in zip(wave_docs, await asyncio.gather(*fetches)):
+                    documents.extend(query_docs)
+                    documents.extend(doc for doc in full_docs if doc)
+                
+                if len(documents) >= max_docs:
+                    break
         
         except Exception as e:
             logger.error(f"❌ Error fetching Microsoft docs: {e}")
@@ -296,6 +330,85 @@ class MicrosoftLearnIndexer:
         logger.info(f"📄 Fetched {len(documents)} documents")
         return documents[:max_docs]
     
+    async def _search_query(self, client: httpx.AsyncClient, query: str) -> List[Dict[str, Any]]:
+        """Search MCP for one query"""
+        documents = []
+        logger.info(f"🔍 Fetching docs for query: '{query}'")
+        
+        # Use MCP microsoft_docs_search to find relevant documents
+        search_response = await client.post(
+            f"{self.mcp_base_url}/mcp/call_tool",
+            content=orjson.dumps({
+                "name": "microsoft_docs_search",
+                "arguments": {"query": query}
+            }),
+            headers={"content-type": "application/json"}
+        )
+        
+        if search_response.status_code == 200:
+            search_data = orjson.loads(search_response.content)
+            
+            # Extract search results
+            if "result" in search_data and "content" in search_data["result"]:
+                content = search_data["result"]["content"]
+                if isinstance(content, list):
+                    for item in content[:10]:  # Limit per query
+                        if isinstance(item, dict) and "text" in item:
+                            doc_text = item["text"]
+                            
+                            # Extract URL if available
+                            url_match = _URL_RE.search(doc_text)
+                            doc_url = url_match.group(0) if url_match else None
+                            
+                            # Extract title (usually first line)
+                            lines = doc_text.strip().split('\n')
+                            title = lines[0][:100] if lines else f"Document for {query}"
+                            
+                            documents.append({
+                                "title": title.strip(),
+                                "content": doc_text,
+                                "url": doc_url,
+                                "source_query": query,
+                                "source_type": "microsoft_learn_search"
+                            })
+        
+        return documents
+    
+    def _full_content_urls(self, documents: List[Dict[str, Any]]) -> List[str]:
+        """URLs of a query's search results worth fetching in full with microsoft_docs_fetch"""
+        unique_urls = list(dict.fromkeys(doc["url"] for doc in documents if doc.get("url")))
+        return [url for url in unique_urls[:5] if urlparse(url).hostname in _ALLOWED_HOSTS]  # Limit to 5 full fetches per query
+    
+    async def _fetch_full_content(self, client: httpx.AsyncClient, url: str, query: str) -> Optional[Dict[str, Any]]:
+        """Fetch a document's full content via MCP; None if unavailable or too short"""
+        try:
+            fetch_response = await client.post(
+                f"{self.mcp_base_url}/mcp/call_tool",
+                content=orjson.dumps({
+                    "name": "microsoft_docs_fetch",
+                    "arguments": {"url": url}
+                }),
+                headers={"content-type": "application/json"}
+            )
+            
+            if fetch_response.status_code == 200:
+                fetch_data = orjson.loads(fetch_response.content)
+                if "result" in fetch_data and "content" in fetch_data["result"]:
+                    full_content = fetch_data["result"]["content"]
+                    if isinstance(full_content, list) and len(full_content) > 0:
+                        content_text = full_content[0].get("text", "")
+                        if len(content_text) > 500:  # Only if substantial content
+                            return {
+                                "title": f"Full content: {url.split('/')[-1]}",
+                                "content": content_text,
+                                "url": url,
+                                "source_query": query,
+                                "source_type": "microsoft_learn_full"
+                            }
+        except Exception as fetch_error:
+            logger.warning(f"⚠️ Failed to fetch full content from {url}: {fetch_error}")
+        return None
+    
     def chunk_document(self, content: str, title: str) -> List[str]:
         """Split document content into overlapping chunks for embedding"""
         if len(content) <= self.chunk_size:
@@ -309,11 +422,11 @@ class MicrosoftLearnIndexer:
             
             # Try to break at a sentence or paragraph boundary
             if end < len(content):
-                # Look for sentence endings
-                for i in range(end, max(start + self.chunk_size // 2, end - 100), -1):
-                    if content[i] in '.!?\n':
-                        end = i + 1
-                        break
+                # Look for the last sentence ending in (lower, end]; str.rfind scans in C
+                lower = max(start + self.chunk_size // 2, end - 100)
+                boundary = max(content.rfind(mark, lower + 1, end + 1) for mark in _SENTENCE_ENDINGS)
+                if boundary >= 0:
+                    end = boundary + 1
             
             chunk = content[start:end].strip()
             if len(chunk) > 50:  # Only include substantial chunks
@@ -344,76 +457,271 @@ class MicrosoftLearnIndexer:
             logger.error(f"❌ Failed to generate embeddings: {e}")
             raise
     
-    async def index_documents(self, documents: List[Dict[str, Any]]) -> bool:
-        """Index documents with embeddings into Azure AI Search"""
+    def _embedding_cache_key(self, text: str) -> str:
+        """Cache key for a chunk; includes the model and deployment so they never share vectors"""
+        return hashlib.sha256(f"{self.embedding_model}:{self.embedding_deployment}:{text}".encode("utf-8")).hexdigest()
+    
+    def _embedding_cache_db(self) -> sqlite3.Connection:
+        """SQLite store for chunk embeddings, opened on first use"""
+        if self._embedding_cache is None:
+            os.makedirs(os.path.dirname(self.embedding_cache_path) or ".", exist_ok=True)
+            self._embedding_cache = sqlite3.connect(self.embedding_cache_path)
+            self._embedding_cache.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            # Upload records are per index, so a different or recreated index never looks up to date
+            self._embedding_cache.execute("DROP TABLE IF EXISTS uploaded")
+            self._embedding_cache.execute(
+                "CREATE TABLE IF NOT EXISTS uploaded_chunks ("
+                "index_name TEXT NOT NULL, id TEXT NOT NULL, content_hash TEXT NOT NULL, "
+                "PRIMARY KEY (index_name, id))"
+            )
+        return self._embedding_cache
+    
+    def _load_cached_embeddings(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """Look up cached embeddings, returning None for keys that are not cached"""
+        found: Dict[str, List[float]] = {}
+        db = self._embedding_cache_db()
+        for i in range(0, len(keys), 500):  # Stay under SQLite's bound-parameter limit
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            for key, vector in db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch):
+                found[key] = array("f", vector).tolist()
+        return [found.get(key) for key in keys]
+    
+    def _store_cached_embeddings(self, items: List[tuple]):
+        """Persist (key, embedding) pairs as float32 blobs"""
+        if not items:
+            return
+        db = self._embedding_cache_db()
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                ((key, array("f", embedding).tobytes()) for key, embedding in items)
+            )
+    
+    def _chunk_content_hash(self, chunk: IndexedChunk) -> str:
+        """Digest of everything uploaded for a chunk except its timestamp and the vector it derives from"""
+        return hashlib.blake2b("\x1f".join((
+            self.embedding_model, self.embedding_deployment, chunk.title, chunk.content,
+            chunk.url, chunk.source_type, chunk.category, str(chunk.chunk_index)
+        )).encode("utf-8"), digest_size=16).hexdigest()
+    
+    def _changed_chunks(self, chunks: List[IndexedChunk]) -> List[IndexedChunk]:
+        """Drop chunks already in the index with the same content as this run would upload"""
+        if self.force_upload:
+            return chunks
+        uploaded: Dict[str, str] = {}
+        db = self._embedding_cache_db()
+        for i in range(0, len(chunks), 500):  # Stay under SQLite's bound-parameter limit
+            batch = [chunk.id for chunk in chunks[i:i + 500]]
+            placeholders = ",".join("?" * len(batch))
+            uploaded.update(db.execute(
+                f"SELECT id, content_hash FROM uploaded_chunks WHERE index_name = ? AND id IN ({placeholders})",
+                [self.search_index_name, *batch]
+            ))
+        return [chunk for chunk in chunks if uploaded.get(chunk.id) != self._chunk_content_hash(chunk)]
+    
+    def _record_uploaded(self, chunks: List[IndexedChunk]):
+        """Remember the content hash of chunks the search service accepted"""
+        if not chunks:
+            return
+        db = self._embedding_cache_db()
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO uploaded_chunks (index_name, id, content_hash) VALUES (?, ?, ?)",
+                ((self.search_index_name, chunk.id, self._chunk_content_hash(chunk)) for chunk in chunks)
+            )
+    
+    def _forget_uploaded(self):
+        """Drop the upload records for this index, so every chunk is uploaded again"""
+        db = self._embedding_cache_db()
+        with db:
+            db.execute("DELETE FROM uploaded_chunks WHERE index_name = ?", (self.search_index_name,))
+    
+    async def _index_is_empty(self) -> bool:
+        """Whether the search index holds no documents, e.g. because it was just recreated"""
         try:
-            logger.info(f"📝 Indexing {len(documents)} documents")
+            return await asyncio.to_thread(self.search_client.get_document_count) == 0
+        except Exception as e:
+            logger.warning(f"⚠️ Could not get the search index document count: {e}")
+            return False
+    
+    def _iter_chunks(self, documents: List[Dict[str, Any]]) -> Iterator[IndexedChunk]:
+        """Yield search documents (without vectors) for every chunk of every document"""
+        last_updated = datetime.utcnow().isoformat() + "Z"
+        # (id, content digest) of chunks already yielded; the same page is often fetched by
+        # several queries and would otherwise be embedded and uploaded once per copy
+        seen = set()
+        duplicates = 0
+        
+        for doc_idx, doc in enumerate(documents):
+            content = doc.get("content", "")
+            title = doc.get("title", f"Document {doc_idx}")
+            url = doc.get("url", "")
+            source_type = doc.get("source_type", "microsoft_learn")
+            category = self._extract_category(url)
+            
+            # Hash the title once; each chunk ID continues from that state, which gives the
+            # same digest as hashing f"{title}_{chunk_idx}_{chunk[:50]}" from scratch
+            title_hash = hashlib.blake2b(title.encode(), digest_size=16)
             
-            search_documents = []
-            texts_to_embed = []
-            doc_metadata = []
+            # Create chunks
+            chunks = self.chunk_document(content, title)
             
-            # Prepare documents and chunks for embedding
-            for doc_idx, doc in enumerate(documents):
-                content = doc.get("content", "")
-                title = doc.get("title", f"Document {doc_idx}")
+            for chunk_idx, chunk in enumerate(chunks):
+                # Create document ID
+                chunk_hash = title_hash.copy()
+                chunk_hash.update(f"_{chunk_idx}_{chunk[:50]}".encode())
+                doc_id = chunk_hash.hexdigest()
                 
-                # Create chunks
-                chunks = self.chunk_document(content, title)
+                fingerprint = (doc_id, hashlib.blake2b(chunk.encode(), digest_size=16).digest())
+                if fingerprint in seen:
+                    duplicates += 1
+                    continue
+                seen.add(fingerprint)
                 
-                for chunk_idx, chunk in enumerate(chunks):
-                    # Create document ID
-                    doc_id = hashlib.md5(f"{title}_{chunk_idx}_{chunk[:50]}".encode()).hexdigest()
-                    
-                    # Prepare for embedding
-                    texts_to_embed.append(chunk)
-                    doc_metadata.append({
-                        "id": doc_id,
-                        "title": title,
-                        "content": chunk,
-                        "url": doc.get("url", ""),
-                        "source_type": doc.get("source_type", "microsoft_learn"),
-                        "category": self._extract_category(doc.get("url", "")),
-                        "last_updated": datetime.utcnow().isoformat() + "Z",
-                        "chunk_index": chunk_idx
-                    })
-            
-            # Generate embeddings in batches
-            batch_size = 50  # Azure OpenAI embedding batch limit
-            all_embeddings = []
-            
-            for i in range(0, len(texts_to_embed), batch_size):
-                batch_texts = texts_to_embed[i:i + batch_size]
-                batch_embeddings = await self.generate_embeddings(batch_texts)
-                all_embeddings.extend(batch_embeddings)
+                yield IndexedChunk(
+                    id=doc_id,
+                    title=title,
+                    content=chunk,
+                    url=url,
+                    source_type=source_type,
+                    category=category,
+                    last_updated=last_updated,
+                    chunk_index=chunk_idx
+                )
+        
+        if duplicates:
+            logger.info(f"♻️ Skipped {duplicates} duplicate chunks")
+    
+    async def index_documents(self, documents: List[Dict[str, Any]]) -> bool:
+        """Index documents with embeddings into Azure AI Search"""
+        pending_upload: Optional[asyncio.Task] = None
+        try:
+            logger.info(f"📝 Indexing {len(documents)} documents")
             
-            # Combine metadata with embeddings
-            for metadata, embedding in zip(doc_metadata, all_embeddings):
-                metadata["content_vector"] = embedding
-                search_documents.append(metadata)
+            # Upload records describe what the index held; a recreated, empty index needs everything
+            if not self.force_upload and await self._index_is_empty():
+                logger.info("🆕 Search index is empty, uploading every chunk")
+                self._forget_uploaded()
             
-            # Upload to Azure AI Search in batches
-            upload_batch_size = 100  # Search service batch limit
+            # Chunks stream through in windows of one round of concurrent embedding batches, so
+            # only the window being embedded and the one being uploaded hold vectors in memory
+            window_size = self.embedding_batch_size * self.max_concurrent_embedding_batches
+            chunks = self._iter_chunks(documents)
             total_uploaded = 0
+            unchanged = 0
+            window_number = 0
             
-            for i in range(0, len(search_documents), upload_batch_size):
-                batch = search_documents[i:i + upload_batch_size]
-                
-                try:
-                    result = self.search_client.upload_documents(documents=batch)
-                    total_uploaded += len(batch)
-                    logger.info(f"📤 Uploaded batch {i//upload_batch_size + 1}: {len(batch)} documents")
-                except Exception as batch_error:
-                    logger.error(f"❌ Failed to upload batch {i//upload_batch_size + 1}: {batch_error}")
+            while window := list(islice(chunks, window_size)):
+                changed = self._changed_chunks(window)
+                unchanged += len(window) - len(changed)
+                if not changed:
                     continue
+                window = changed
+                await self._embed_window(window)
+                if pending_upload is not None:
+                    total_uploaded += await pending_upload
+                pending_upload = asyncio.create_task(self._upload_window(window, window_number * window_size))
+                window_number += 1
+            
+            if pending_upload is not None:
+                total_uploaded += await pending_upload
             
+            if unchanged:
+                logger.info(f"⏭️ Skipped {unchanged} chunks unchanged since their last upload")
             logger.info(f"✅ Successfully indexed {total_uploaded} document chunks")
             return True
             
         except Exception as e:
+            if pending_upload is not None:
+                pending_upload.cancel()
             logger.error(f"❌ Failed to index documents: {e}")
             return False
     
+    async def _embed_window(self, window: List[IndexedChunk]):
+        """Attach content_vector to each chunk, embedding only the chunks missing from the cache"""
+        # Serve unchanged chunks from the persistent embedding cache; only misses hit the API
+        cache_keys = [self._embedding_cache_key(chunk.content) for chunk in window]
+        all_embeddings = self._load_cached_embeddings(cache_keys)
+        miss_indices = [i for i, embedding in enumerate(all_embeddings) if embedding is None]
+        
+        # Identical chunks (e.g. the same page found by several queries) are embedded once
+        missing: Dict[str, str] = {}
+        for i in miss_indices:
+            missing.setdefault(cache_keys[i], window[i].content)
+        miss_texts = list(missing.values())
+        logger.info(
+            f"💾 Embedding cache: {len(window) - len(miss_indices)} hits, "
+            f"{len(miss_indices) - len(miss_texts)} duplicates, {len(miss_texts)} to embed"
+        )
+        
+        # Generate embeddings in batches, several requests in flight at once
+        batch_size = self.embedding_batch_size
+        new_embeddings: List[Optional[List[float]]] = [None] * len(miss_texts)
+        semaphore = asyncio.Semaphore(self.max_concurrent_embedding_batches)
+        
+        async def _embed_batch(offset: int):
+            batch_texts = miss_texts[offset:offset + batch_size]
+            async with semaphore:
+                # Small jitter so concurrent batches don't hit the rate limiter in lockstep
+                await asyncio.sleep(random.uniform(0, 0.1))
+                batch_embeddings = await self.generate_embeddings(batch_texts)
+            new_embeddings[offset:offset + len(batch_embeddings)] = batch_embeddings
+        
+        await asyncio.gather(*(
+            _embed_batch(offset) for offset in range(0, len(miss_texts), batch_size)
+        ))
+        
+        embedded = dict(zip(missing, new_embeddings))
+        for i in miss_indices:
+            all_embeddings[i] = embedded[cache_keys[i]]
+        self._store_cached_embeddings(list(embedded.items()))
+        
+        # Combine metadata with embeddings; the index stores float16, so digits beyond its
+        # precision are dropped to shrink the upload payload
+        for chunk, embedding in zip(window, all_embeddings):
+            chunk.content_vector = [round(value, _VECTOR_DECIMALS) for value in embedding]
+    
+    async def _upload_window(self, chunks: List[IndexedChunk], first_index: int) -> int:
+        """Upload a window of embedded chunks; returns how many were uploaded"""
+        # Upload to Azure AI Search in batches, several at once on worker threads
+        upload_batch_size = 100  # Search service batch limit
+        semaphore = asyncio.Semaphore(self.max_concurrent_uploads)
+        
+        async def _upload_batch(offset: int) -> int:
+            batch_chunks = chunks[offset:offset + upload_batch_size]
+            batch = [chunk.to_document() for chunk in batch_chunks]
+            batch_number = (first_index + offset) // upload_batch_size + 1
+            async with semaphore:
+                try:
+                    results = await self._upload_with_retry(batch)
+                    succeeded = {result.key for result in results if result.succeeded}
+                    self._record_uploaded([chunk for chunk in batch_chunks if chunk.id in succeeded])
+                    logger.info(f"📤 Uploaded batch {batch_number}: {len(succeeded)}/{len(batch)} documents")
+                    return len(succeeded)
+                except Exception as batch_error:
+                    logger.error(f"❌ Failed to upload batch {batch_number}: {batch_error}")
+                    return 0
+        
+        uploaded = await asyncio.gather(*(
+            _upload_batch(offset) for offset in range(0, len(chunks), upload_batch_size)
+        ))
+        return sum(uploaded)
+    
+    async def _upload_with_retry(self, batch: List[Dict[str, Any]], max_attempts: int = 5):
+        """Upload one batch, backing off exponentially (with jitter) while the service is throttling"""
+        for attempt in range(max_attempts):
+            try:
+                return await asyncio.to_thread(self.search_client.merge_or_upload_documents, documents=batch)
+            except HttpResponseError as e:
+                if e.status_code not in (429, 503) or attempt == max_attempts - 1:
+                    raise
+                delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+                logger.warning(f"⏳ Search service throttled upload (HTTP {e.status_code}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    
     def _extract_category(self, url: str) -> str:
         """Extract category from Microsoft Learn URL"""
         if not url:
@@ -422,18 +730,12 @@ class MicrosoftLearnIndexer:
         try:
             path = urlparse(url).path.lower()
             
-            if "/azure/" in path:
-                return "azure"
-            elif "/dotnet/" in path:
-                return "dotnet"
-            elif "/microsoft-365/" in path:
-                return "microsoft-365"
-            elif "/power-platform/" in path:
-                return "power-platform"
-            elif "/windows/" in path:
-                return "windows"
-            else:
-                return "general"
+            # Directory segments, i.e. those with a "/" on both sides
+            segments = set(path.split("/")[1:-1])
+            for segment, category in _CATEGORY_SEGMENTS:
+                if segment in segments:
+                    return category
+            return "general"
         except:
             return "general"
     
@@ -512,7 +814,10 @@ async def main():
     indexer = MicrosoftLearnIndexer()
     
     # Run the full indexing pipeline
-    success = await indexer.run_full_indexing()
+    try:
+        success = await indexer.run_full_indexing()
+    finally:
+        await indexer.aclose()
     
     if success:
         print("✅ Microsoft Learn indexing completed successfully!")
@@ -521,4 +826,9 @@ async def main():
         print("❌ Indexing failed. Check the logs for details.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        import uvloop
+        run = uvloop.run
+    except ImportError:
+        run = asyncio.run
+    run(main())
\ No newline at end of file
@@ -1,11 +1,20 @@
 """
 Simple MCP-only validation - Single source of truth
 """
+import ast
+import asyncio
 import httpx
-import json
+import importlib
+import inspect
+import orjson
 import logging
+import os
+import pkgutil
 import re
-from typing import Dict, Any, List
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -14,19 +23,185 @@ DAPR_PORT = "3500"
 DAPR_SERVICE_ID = "mcp-service"
 MCP_SERVICE_URL = f"http://localhost:{DAPR_PORT}/v1.0/invoke/{DAPR_SERVICE_ID}/method"
 MCP_TIMEOUT = 30
+# Components per validate_azure_components call; larger sets are split into concurrent calls
+MCP_VALIDATION_BATCH_SIZE = 32
 
-async def extract_components_from_code(diagram_code: str) -> List[str]:
-    """Extract Azure component names from import statements"""
-    components = []
-    import_pattern = r'from diagrams\.azure\.\w+ import ([\w, ]+)'
+# MCP validation results per component set: frozenset(components) -> (timestamp, validation data)
+MCP_VALIDATION_CACHE_TTL = int(os.getenv("MCP_VALIDATION_CACHE_TTL", "300"))
+_VALIDATION_CACHE_MAX = 1024
+_validation_cache: "OrderedDict[frozenset, tuple[float, dict]]" = OrderedDict()
+
+def _cached_validation(key: frozenset) -> Optional[dict]:
+    entry = _validation_cache.get(key)
+    if entry is None:
+        return None
+    
+    timestamp, validation_data = entry
+    if time.monotonic() - timestamp > MCP_VALIDATION_CACHE_TTL:
+        del _validation_cache[key]
+        return None
+    
+    _validation_cache.move_to_end(key)
+    return validation_data
+
+def _cache_validation(key: frozenset, validation_data: dict):
+    _validation_cache[key] = (time.monotonic(), validation_data)
+    _validation_cache.move_to_end(key)
+    while len(_validation_cache) > _VALIDATION_CACHE_MAX:
+        _validation_cache.popitem(last=False)
+
+@lru_cache(maxsize=None)
+def _local_catalog() -> Dict[str, Tuple[str, ...]]:
+    """Component name (class or alias) -> submodules defining it, from the installed diagrams.azure package"""
+    try:
+        import diagrams.azure
+    except ImportError:
+        return {}
+    
+    catalog: Dict[str, Tuple[str, ...]] = {}
+    for module_info in pkgutil.iter_modules(diagrams.azure.__path__):
+        try:
+            module = importlib.import_module(f"diagrams.azure.{module_info.name}")
+        except Exception as e:
+            logger.warning("Could not load diagrams.azure.%s: %s", module_info.name, e)
+            continue
+        for name, cls in inspect.getmembers(module, inspect.isclass):
+            if not name.startswith("_") and cls.__module__ == module.__name__:
+                # Keyed by the name as written: aliases such as AKS are valid as they stand
+                catalog[name] = catalog.get(name, ()) + (module_info.name,)
+    return catalog
+
+def _local_result(submodule: str, canonical: str) -> Dict[str, Any]:
+    """Validation entry in the shape the MCP validate_azure_components tool returns"""
+    return {
+        "valid": True,
+        "canonical": canonical,
+        "submodule": submodule,
+        "import_path": f"diagrams.azure.{submodule}"
+    }
+
+# Shared connection pool to the sidecar for validation calls (closed on app shutdown)
+_validation_client: Optional[httpx.AsyncClient] = None
+
+def get_validation_client() -> httpx.AsyncClient:
+    """Return the shared validation HTTP client, creating it on first use"""
+    global _validation_client
+    
+    if _validation_client is None or _validation_client.is_closed:
+        _validation_client = httpx.AsyncClient(
+            timeout=MCP_TIMEOUT,
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=30.0)
+        )
+    return _validation_client
+
+async def close_validation_client():
+    """Close the shared validation HTTP client"""
+    global _validation_client
+    
+    if _validation_client is not None:
+        await _validation_client.aclose()
+        _validation_client = None
+
+IMPORT_RE = re.compile(r'from (diagrams\.azure\.\w+) import ([\w, ]+)')
+
+# A whole Azure import statement, including parenthesised multi-line name lists
+IMPORT_LINE_RE = re.compile(r'^([ \t]*)from (diagrams\.azure\.\w+) import (\([^)]*\)|[^\n#]+)', re.MULTILINE)
+
+def _trie_pattern(names: Tuple[str, ...]) -> str:
+    """
+    Regex matching any of the names, factored into a prefix trie
+    
+    A flat alternation retries every name at every position; the trie form shares common
+    prefixes (SQL..., Function..., ...), so each position is examined about once.
+    """
+    trie: Dict[str, dict] = {}
+    for name in names:
+        node = trie
+        for char in name:
+            node = node.setdefault(char, {})
+        node[""] = {}  # A name ends here
+    
+    def _build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(char) + _build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        if "" in node:
+            return "(?:" + "|".join(branches) + ")?"
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    
+    return _build(trie)
+
+@lru_cache(maxsize=1024)
+def _fix_re(names: Tuple[str, ...]) -> re.Pattern:
+    """Azure import statements or whole-word uses of the given names, compiled once per name set"""
+    pattern = IMPORT_LINE_RE.pattern
+    if names:
+        pattern += r'|\b(' + _trie_pattern(names) + r')\b'
+    return re.compile(pattern, re.MULTILINE)
+
+def _apply_fixes(code: str, replacements: Dict[str, Tuple[str, str]], renames: Dict[str, str]) -> Tuple[str, List[str]]:
+    """
+    Rewrite imports and rename components in a single pass, so the fixed code is built once
+    
+    Every imported component is pointed at its corrected (module, name), regrouping each import
+    statement by target module and keeping aliases; every other whole-word use of a renamed
+    component gets its new name.
     
-    matches = re.findall(import_pattern, diagram_code)
-    for imports in matches:
-        # Split multiple imports and clean them
-        comps = [comp.strip().split(' as ')[0] for comp in imports.split(',')]
-        components.extend([comp.strip() for comp in comps])
+    Returns the new code and the components whose import was rewritten
+    """
+    rewritten = []
+    
+    def _regroup(match: re.Match) -> str:
+        indent, module, names = match.group(1, 2, 3)
+        grouped: Dict[str, List[str]] = {}
+        changed = False
+        for item in names.strip("() \t\n").split(","):
+            parts = item.split()
+            if not parts:
+                continue
+            name = parts[0]
+            alias = f" as {parts[2]}" if len(parts) == 3 and parts[1] == "as" else ""
+            target_module, target_name = replacements.get(name, (module, name))
+            if (target_module, target_name) != (module, name):
+                rewritten.append(name)
+                changed = True
+            grouped.setdefault(target_module, []).append(target_name + alias)
+        if not changed:
+            return match.group(0)
+        return "\n".join(
+            f"{indent}from {target_module} import {', '.join(dict.fromkeys(target_names))}"
+            for target_module, target_names in grouped.items()
+        )
+    
+    def _fix(match: re.Match) -> str:
+        if match.group(2) is None:
+            return renames[match.group(4)]
+        return _regroup(match)
     
-    return list(set(components))  # Remove duplicates
+    return _fix_re(tuple(sorted(renames))).sub(_fix, code), rewritten
+
+def _imported_components(diagram_code: str) -> Dict[str, str]:
+    """Azure component name -> module it is imported from, in import order"""
+    imported: Dict[str, str] = {}
+    try:
+        # The parser handles aliases and parenthesised multi-line imports natively
+        tree = ast.parse(diagram_code)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.module and node.module.startswith("diagrams.azure."):
+                for alias in node.names:
+                    imported.setdefault(alias.name, node.module)
+    except SyntaxError:
+        # Generated code that does not parse yet; fall back to scanning the import lines
+        matches = IMPORT_RE.findall(diagram_code)
+        for module, imports in matches:
+            # Split multiple imports and clean them
+            for comp in imports.split(','):
+                imported.setdefault(comp.strip().split(' as ')[0].strip(), module)
+    return imported
+
+async def extract_components_from_code(diagram_code: str) -> List[str]:
+    """Extract Azure component names from import statements"""
+    return list(_imported_components(diagram_code))  # Duplicates removed, import order kept
 
 async def validate_and_fix_diagram_code_simple(diagram_code: str, architecture_description: str = "") -> Dict[str, Any]:
     """
@@ -39,7 +214,8 @@ async def validate_and_fix_diagram_code_simple(diagram_code: str, architecture_d
         logger.info("🔌 Using MCP service as single source of truth for validation...")
         
         # Step 1: Extract all Azure components from the code
-        components = await extract_components_from_code(diagram_code)
+        imported = _imported_components(diagram_code)
+        components = list(imported)
         if not components:
             logger.warning("No Azure components found in code")
             return {
@@ -52,151 +228,197 @@ async def validate_and_fix_diagram_code_simple(diagram_code: str, architecture_d
                 "explanation": "No Azure components to validate"
             }
         
-        logger.info(f"� Found components to validate: {components}")
+        logger.info("� Found %d components to validate", len(components))
+        logger.debug("Components to validate: %s", components)
         
-        # Step 2: Validate components via MCP
-        async with httpx.AsyncClient(timeout=MCP_TIMEOUT) as client:
-            response = await client.post(
-                f"{MCP_SERVICE_URL}/mcp/tools/call",
-                json={
-                    "name": "validate_azure_components",
-                    "arguments": {
-                        "component_names": components
-                    }
-                }
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"❌ MCP component validation failed: {response.status_code}")
-                return {
-                    "is_valid": False,
-                    "validation_score": 0,
-                    "corrected_code": diagram_code,
-                    "errors": [f"MCP service error: {response.status_code}"],
-                    "warnings": [],
-                    "suggestions": ["Check MCP service connectivity"],
-                    "explanation": "MCP validation service unavailable"
-                }
-            
-            result = response.json()
-            if not result.get("success") or result.get("error"):
-                logger.error(f"❌ MCP validation failed: {result}")
-                return {
-                    "is_valid": False,
-                    "validation_score": 0,
-                    "corrected_code": diagram_code,
-                    "errors": ["MCP validation failed"],
-                    "warnings": [],
-                    "suggestions": ["Check MCP service response"],
-                    "explanation": "MCP validation error"
-                }
-            
-            # Parse MCP validation result
-            mcp_result = result["result"]["result"]
-            if mcp_result.get("isError"):
-                logger.error(f"❌ MCP returned error: {mcp_result}")
-                return {
-                    "is_valid": False,
-                    "validation_score": 0,
-                    "corrected_code": diagram_code,
-                    "errors": ["MCP validation error"],
-                    "warnings": [],
-                    "suggestions": [],
-                    "explanation": "MCP validation failed"
-                }
-            
-            # Parse the validation results
-            validation_content = mcp_result["content"][0]["text"]
-            validation_data = json.loads(validation_content)
-            
-            logger.info(f"✅ MCP validation successful: {validation_data}")
-            
-            # Step 3: Apply fixes based on MCP results
-            corrected_code = diagram_code
-            errors = []
-            corrections_made = []
-            
-            validation_results = validation_data.get("validation_results", {})
+        # Step 2: Resolve names the installed diagrams package defines; only the rest need MCP
+        catalog = _local_catalog()
+        local_results = {}
+        for component in components:
+            submodules = catalog.get(component)
+            if submodules:
+                # Valid as written when the imported module defines it (several modules define
+                # e.g. BlobStorage); otherwise suggest the first module that does
+                imported_submodule = imported[component].rsplit(".", 1)[-1]
+                submodule = imported_submodule if imported_submodule in submodules else submodules[0]
+                local_results[component] = _local_result(submodule, component)
+        unknown = [component for component in components if component not in local_results]
+        
+        # Step 3: Validate the rest via MCP, unless this component set was validated recently
+        cache_key = frozenset(unknown)
+        validation_data = _cached_validation(cache_key) if unknown else {}
+        if validation_data is None:
+            # Large component sets go out as several concurrent calls instead of one long one
+            client = get_validation_client()
+            batches = [
+                unknown[i:i + MCP_VALIDATION_BATCH_SIZE]
+                for i in range(0, len(unknown), MCP_VALIDATION_BATCH_SIZE)
+            ]
+            responses = await asyncio.gather(*(
+                client.post(
+                    f"{MCP_SERVICE_URL}/mcp/tools/call",
+                    content=orjson.dumps({
+                        "name": "validate_azure_components",
+                        "arguments": {
+                            "component_names": batch
+                        }
+                    }),
+                    headers={"content-type": "application/json"}
+                )
+                for batch in batches
+            ))
             
-            for component, result_data in validation_results.items():
-                if result_data.get("valid"):
-                    correct_import = result_data.get("import_path")
-                    canonical_name = result_data.get("canonical")
-                    
-                    # Fix import path if needed
-                    if correct_import:
-                        # Replace incorrect import with correct one
-                        import_pattern = rf'from diagrams\.azure\.\w+ import ([^,\n]*{re.escape(component)}[^,\n]*)'
-                        corrected_import = f'from {correct_import} import {canonical_name}'
-                        
-                        if re.search(import_pattern, corrected_code):
-                            corrected_code = re.sub(
-                                rf'from diagrams\.azure\.\w+ import ([^,\n]*{re.escape(component)}[^,\n]*)',
-                                corrected_import,
-                                corrected_code
-                            )
-                            corrections_made.append(f"Fixed import for {component}: {corrected_import}")
-                        
-                        # Fix class name if different from original
-                        if canonical_name != component:
-                            corrected_code = re.sub(
-                                rf'\b{re.escape(component)}\b',
-                                canonical_name,
-                                corrected_code
-                            )
-                            corrections_made.append(f"Fixed class name: {component} → {canonical_name}")
+            for response in responses:
+                if response.status_code != 200:
+                    logger.error("❌ MCP component validation failed: %s", response.status_code)
+                    return {
+                        "is_valid": False,
+                        "validation_score": 0,
+                        "corrected_code": diagram_code,
+                        "errors": [f"MCP service error: {response.status_code}"],
+                        "warnings": [],
+                        "suggestions": ["Check MCP service connectivity"],
+                        "explanation": "MCP validation service unavailable"
+                    }
+                
+                result = orjson.loads(response.content)
+                if not result.get("success") or result.get("error"):
+                    logger.error("❌ MCP validation failed: %s", result)
+                    return {
+                        "is_valid": False,
+                        "validation_score": 0,
+                        "corrected_code": diagram_code,
+                        "errors": ["MCP validation failed"],
+                        "warnings": [],
+                        "suggestions": ["Check MCP service response"],
+                        "explanation": "MCP validation error"
+                    }
+                
+                # Parse MCP validation result
+                mcp_result = result["result"]["result"]
+                if mcp_result.get("isError"):
+                    logger.error("❌ MCP returned error: %s", mcp_result)
+                    return {
+                        "is_valid": False,
+                        "validation_score": 0,
+                        "corrected_code": diagram_code,
+                        "errors": ["MCP validation error"],
+                        "warnings": [],
+                        "suggestions": [],
+                        "explanation": "MCP validation failed"
+                    }
+                
+                # Parse the validation results and merge them across batches
+                validation_content = mcp_result["content"][0]["text"]
+                batch_data = orjson.loads(validation_content)
+                if validation_data is None:
+                    validation_data = batch_data
                 else:
-                    # Handle invalid components with suggestions
-                    suggestions = result_data.get("suggestions", [])
-                    if suggestions:
-                        # Use the first suggestion (most relevant)
-                        best_suggestion = suggestions[0]
-                        suggested_name = best_suggestion["name"]
-                        suggested_submodule = best_suggestion["submodule"]
-                        suggested_import = f"diagrams.azure.{suggested_submodule}"
-                        
-                        # Replace the invalid component with the suggested one
-                        # Fix import
-                        import_pattern = rf'from diagrams\.azure\.\w+ import ([^,\n]*{re.escape(component)}[^,\n]*)'
-                        corrected_import = f'from {suggested_import} import {suggested_name}'
-                        
-                        if re.search(import_pattern, corrected_code):
-                            corrected_code = re.sub(import_pattern, corrected_import, corrected_code)
-                            corrections_made.append(f"Fixed invalid component {component} → {suggested_name}: {corrected_import}")
-                        
-                        # Fix class usage in code
-                        corrected_code = re.sub(
-                            rf'\b{re.escape(component)}\b',
-                            suggested_name,
-                            corrected_code
-                        )
-                        corrections_made.append(f"Replaced {component} with {suggested_name} in code")
-                    else:
-                        errors.append(f"Component '{component}' is not valid in Azure diagrams and no suggestions available")
-            
-            # Check if we have invalid components
-            invalid_count = validation_data.get("invalid_count", 0)
-            valid_count = validation_data.get("valid_count", 0)
-            
-            is_valid = invalid_count == 0
-            validation_score = int((valid_count / len(components)) * 100) if components else 100
+                    validation_data.setdefault("validation_results", {}).update(batch_data.get("validation_results", {}))
+                    for count in ("valid_count", "invalid_count"):
+                        validation_data[count] = validation_data.get(count, 0) + batch_data.get(count, 0)
             
-            explanation = f"MCP validation completed: {valid_count} valid, {invalid_count} invalid components"
-            if corrections_made:
-                explanation += f". Applied fixes: {', '.join(corrections_made)}"
-            
-            return {
-                "is_valid": is_valid,
-                "validation_score": validation_score,
-                "corrected_code": corrected_code,
-                "errors": errors,
-                "warnings": [],
-                "suggestions": corrections_made,
-                "explanation": explanation
+            _cache_validation(cache_key, validation_data)
+        
+        if local_results:
+            mcp_results = validation_data.get("validation_results", {})
+            validation_data = {
+                **validation_data,
+                "validation_results": {
+                    component: local_results.get(component) or mcp_results[component]
+                    for component in components if component in local_results or component in mcp_results
+                },
+                "valid_count": validation_data.get("valid_count", 0) + len(local_results),
+                "invalid_count": validation_data.get("invalid_count", 0)
             }
-            
+        
+        logger.info(
+            "✅ MCP validation successful: %d valid, %d invalid",
+            validation_data.get("valid_count", 0), validation_data.get("invalid_count", 0)
+        )
+        logger.debug("MCP validation payload: %s", validation_data)
+        
+        # Step 4: Apply fixes based on MCP results
+        corrected_code = diagram_code
+        errors = []
+        corrections_made = []
+        
+        validation_results = validation_data.get("validation_results", {})
+        if validation_data.get("invalid_count", 0) == 0 and all(
+            result_data.get("valid")
+            and result_data.get("canonical") == component
+            and result_data.get("import_path") == imported.get(component)
+            for component, result_data in validation_results.items()
+        ):
+            # Every component is valid, canonical and imported from the right module: nothing to fix
+            validation_results = {}
+        
+        # component -> (module, name) it should be imported as; the code is then rewritten
+        # in a single pass instead of several per component
+        replacements: Dict[str, Tuple[str, str]] = {}
+        import_notes: Dict[str, str] = {}
+        rename_notes: Dict[str, str] = {}
+        
+        for component, result_data in validation_results.items():
+            if result_data.get("valid"):
+                correct_import = result_data.get("import_path")
+                canonical_name = result_data.get("canonical")
+                
+                # Fix import path if needed
+                if correct_import:
+                    replacements[component] = (correct_import, canonical_name)
+                    import_notes[component] = f"Fixed import for {component}: from {correct_import} import {canonical_name}"
+                    
+                    # Fix class name if different from original
+                    if canonical_name != component:
+                        rename_notes[component] = f"Fixed class name: {component} → {canonical_name}"
+            else:
+                # Handle invalid components with suggestions
+                suggestions = result_data.get("suggestions", [])
+                if suggestions:
+                    # Use the first suggestion (most relevant)
+                    best_suggestion = suggestions[0]
+                    suggested_name = best_suggestion["name"]
+                    suggested_import = f"diagrams.azure.{best_suggestion['submodule']}"
+                    
+                    # Replace the invalid component with the suggested one
+                    replacements[component] = (suggested_import, suggested_name)
+                    import_notes[component] = f"Fixed invalid component {component} → {suggested_name}: from {suggested_import} import {suggested_name}"
+                    rename_notes[component] = f"Replaced {component} with {suggested_name} in code"
+                else:
+                    errors.append(f"Component '{component}' is not valid in Azure diagrams and no suggestions available")
+        
+        if replacements:
+            corrected_code, rewritten = _apply_fixes(corrected_code, replacements, {
+                component: replacements[component][1] for component in rename_notes
+                if replacements[component][1] != component
+            })
+            corrections_made.extend(import_notes[component] for component in dict.fromkeys(rewritten))
+            corrections_made.extend(rename_notes.values())
+        
+        # Check if we have invalid components
+        invalid_count = validation_data.get("invalid_count", 0)
+        valid_count = validation_data.get("valid_count", 0)
+        
+        is_valid = invalid_count == 0
+        validation_score = int((valid_count / len(components)) * 100) if components else 100
+        
+        explanation = f"MCP validation completed: {valid_count} valid, {invalid_count} invalid components"
+        if corrections_made:
+            explanation += f". Applied fixes: {', '.join(corrections_made)}"
+        
+        return {
+            "is_valid": is_valid,
+            "validation_score": validation_score,
+            "corrected_code": corrected_code,
+            "errors": errors,
+            "warnings": [],
+            "suggestions": corrections_made,
+            "explanation": explanation
+        }
+        
     except Exception as e:
-        logger.error(f"❌ MCP validation error: {e}")
+        logger.error("❌ MCP validation error: %s", e)
         return {
             "is_valid": False,
             "validation_score": 0,
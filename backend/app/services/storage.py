@@ -1,26 +1,142 @@
-import json
+import hashlib
 import os
 from datetime import datetime
 from uuid import uuid4
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Set
 import asyncio
+import threading
+import orjson
 
 # Import Azure services
 from .azure_cosmos import cosmos_service
 from .azure_storage import storage_service
 
-# Fallback local data path
-DATA_PATH = "data/architectures.json"
+# Fallback local data: one architecture per line, oldest first, so a save is a single append.
+# Deletes only record the id in the tombstone file until compaction rewrites the data file.
+DATA_PATH = "data/architectures.ndjson"
+TOMBSTONES_PATH = "data/tombstones.json"
+LEGACY_DATA_PATH = "data/architectures.json"
+
+# Compact once tombstones make up this share of the records in the data file
+COMPACTION_RATIO = 0.25
+
+# Local design_document hash -> id of the newest architecture with that document,
+# built from the data file on first use and kept in step with appends and deletes
+_design_index: Optional[Dict[str, str]] = None
+
+
+def _write_atomic(path: str, data: bytes):
+    """Replace a file in one step, so a crash mid-write never leaves it truncated"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _ndjson(items: Iterable[Dict]) -> bytes:
+    return b"".join(orjson.dumps(item) + b"\n" for item in items)
 
 # Ensure the local data directory exists for fallback
 os.makedirs("data", exist_ok=True)
 if not os.path.exists(DATA_PATH):
-    with open(DATA_PATH, "w") as f:
-        json.dump([], f)
+    legacy_items = []
+    # Carry over architectures saved in the old single JSON array format (newest first)
+    if os.path.exists(LEGACY_DATA_PATH):
+        with open(LEGACY_DATA_PATH, "rb") as legacy:
+            legacy_items = orjson.loads(legacy.read())
+    _write_atomic(DATA_PATH, _ndjson(reversed(legacy_items)))
+
+
+def _load_tombstones() -> Set[str]:
+    """Ids of locally deleted architectures that are still in the data file"""
+    try:
+        with open(TOMBSTONES_PATH, "rb") as f:
+            return set(orjson.loads(f.read()))
+    except FileNotFoundError:
+        return set()
+
+def _save_tombstones(tombstones: Set[str]):
+    _write_atomic(TOMBSTONES_PATH, orjson.dumps(sorted(tombstones)))
+
+def _read_records() -> List[Dict]:
+    """Every record in the data file, oldest first, including deleted ones"""
+    with open(DATA_PATH, "rb") as f:
+        return [orjson.loads(line) for line in f if line.strip()]
+
+def _read_local(limit: Optional[int] = None) -> List[Dict]:
+    """Live local architectures, newest first"""
+    tombstones = _load_tombstones()
+    items = [item for item in reversed(_read_records()) if item.get("id") not in tombstones]
+    return items if limit is None else items[:limit]
+
+def _design_hash(design_document: str) -> str:
+    return hashlib.blake2b(design_document.encode("utf-8"), digest_size=16).hexdigest()
+
+def _local_design_index() -> Dict[str, str]:
+    global _design_index
+    if _design_index is None:
+        # Oldest first, so the newest architecture wins for a repeated design
+        _design_index = {
+            item.get("designHash") or _design_hash(item.get("design_document", "")): item["id"]
+            for item in reversed(_read_local())
+        }
+    return _design_index
+
+def _append_local(item: Dict):
+    with open(DATA_PATH, "ab") as f:
+        f.write(orjson.dumps(item) + b"\n")
+    if _design_index is not None:
+        _design_index[item["designHash"]] = item["id"]
+
+def _delete_local(architecture_id: str) -> bool:
+    """Tombstone a local architecture, compacting the data file once enough records are dead"""
+    tombstones = _load_tombstones()
+    records = _read_records()
+    if architecture_id in tombstones or not any(item.get("id") == architecture_id for item in records):
+        return False
+    
+    tombstones.add(architecture_id)
+    if _design_index is not None:
+        for design_hash in [h for h, item_id in _design_index.items() if item_id == architecture_id]:
+            del _design_index[design_hash]
+    if len(tombstones) > len(records) * COMPACTION_RATIO:
+        _write_atomic(DATA_PATH, _ndjson([item for item in records if item.get("id") not in tombstones]))
+        tombstones = set()
+    _save_tombstones(tombstones)
+    return True
+
+def _find_local(architecture_id: str) -> Optional[Dict]:
+    return next((item for item in _read_local() if item.get("id") == architecture_id), None)
+
+def _find_local_by_design(design_hash: str) -> Optional[Dict]:
+    architecture_id = _local_design_index().get(design_hash)
+    return None if architecture_id is None else _find_local(architecture_id)
+
+# Local file operations run on worker threads so they never block the event loop;
+# the lock keeps their read-modify-write steps and the design index consistent
+_local_lock = threading.Lock()
+
+async def _run_local(func, *args):
+    def _locked():
+        with _local_lock:
+            return func(*args)
+    return await asyncio.to_thread(_locked)
 
 # Configuration
 USE_AZURE_SERVICES = os.getenv("USE_AZURE_SERVICES", "true").lower() == "true"
 
+# The sync wrappers run their coroutines on one long-lived event loop in a background
+# thread instead of building a new loop per call
+_sync_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_loop_lock = threading.Lock()
+
+def _run_sync(coro):
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            _sync_loop = asyncio.new_event_loop()
+            threading.Thread(target=_sync_loop.run_forever, name="storage-sync-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _sync_loop).result()
+
 
 async def load_architectures(user_id: str = "anonymous", limit: int = 50) -> List[Dict]:
     """Load architectures from Azure CosmosDB or local fallback"""
@@ -32,38 +148,43 @@ async def load_architectures(user_id: str = "anonymous", limit: int = 50) -> Lis
     
     # Local fallback
     try:
-        with open(DATA_PATH, "r") as f:
-            return json.load(f)
+        return await _run_local(_read_local, limit)
     except Exception:
         return []
 
 def load_architectures_sync():
     """Synchronous version for backwards compatibility"""
-    try:
-        loop = asyncio.get_event_loop()
-        return loop.run_until_complete(load_architectures())
-    except RuntimeError:
-        # No event loop running, use new one
-        return asyncio.run(load_architectures())
+    return _run_sync(load_architectures())
 
 
+async def _find_by_design(design_hash: str, design_document: str, user_id: str) -> Optional[Dict]:
+    """Find an architecture with this design document via the hash rather than comparing every document"""
+    if USE_AZURE_SERVICES:
+        try:
+            return await cosmos_service.find_by_design(design_hash, design_document, user_id)
+        except Exception as e:
+            print(f"Error querying CosmosDB, using local fallback: {e}")
+    
+    # Local fallback
+    return await _run_local(_find_local_by_design, design_hash)
+
 async def save_architecture(title: str, preview: str, design_document: str, diagram_url: str, user_id: str = "anonymous") -> Dict:
     """Save architecture to Azure CosmosDB or local fallback"""
     
     # Check if architecture with same design document already exists
-    items = await load_architectures(user_id)
-    for item in items:
-        if item.get("design_document") == design_document:
-            # Return existing item instead of creating duplicate
-            return {
-                "id": item["id"],
-                "title": item["title"],
-                "preview": item["preview"],
-                "design_document": item["design_document"],
-                "diagram_url": item["diagram_url"],
-                "timestamp": item.get("createdAt", item.get("timestamp")),
-                "already_exists": True  # Flag to indicate it already existed
-            }
+    design_hash = _design_hash(design_document)
+    item = await _find_by_design(design_hash, design_document, user_id)
+    if item:
+        # Return existing item instead of creating duplicate
+        return {
+            "id": item["id"],
+            "title": item["title"],
+            "preview": item["preview"],
+            "design_document": item["design_document"],
+            "diagram_url": item["diagram_url"],
+            "timestamp": item.get("createdAt", item.get("timestamp")),
+            "already_exists": True  # Flag to indicate it already existed
+        }
 
     new_item = {
         "id": str(uuid4()),
@@ -72,7 +193,8 @@ async def save_architecture(title: str, preview: str, design_document: str, diag
         "design_document": design_document,
         "diagram_url": diagram_url,
         "timestamp": datetime.utcnow().isoformat(),
-        "userId": user_id
+        "userId": user_id,
+        "designHash": design_hash
     }
 
     if USE_AZURE_SERVICES:
@@ -85,20 +207,13 @@ async def save_architecture(title: str, preview: str, design_document: str, diag
             print(f"Error saving to CosmosDB, using local fallback: {e}")
     
     # Local fallback
-    items.insert(0, new_item)
-    with open(DATA_PATH, "w") as f:
-        json.dump(items, f, indent=2)
+    await _run_local(_append_local, new_item)
 
     return new_item
 
 def save_architecture_sync(title: str, preview: str, design_document: str, diagram_url: str, user_id: str = "anonymous") -> Dict:
     """Synchronous version for backwards compatibility"""
-    try:
-        loop = asyncio.get_event_loop()
-        return loop.run_until_complete(save_architecture(title, preview, design_document, diagram_url, user_id))
-    except RuntimeError:
-        # No event loop running, use new one
-        return asyncio.run(save_architecture(title, preview, design_document, diagram_url, user_id))
+    return _run_sync(save_architecture(title, preview, design_document, diagram_url, user_id))
 
 async def upload_diagram(file_path: str, filename: str = None) -> Optional[str]:
     """Upload diagram to Azure Storage or keep local"""
@@ -120,11 +235,7 @@ async def get_architecture(architecture_id: str, user_id: str = "anonymous") ->
             print(f"Error getting from CosmosDB, using local fallback: {e}")
     
     # Local fallback
-    items = await load_architectures()
-    for item in items:
-        if item.get("id") == architecture_id:
-            return item
-    return None
+    return await _run_local(_find_local, architecture_id)
 
 async def delete_architecture(architecture_id: str, user_id: str = "anonymous") -> bool:
     """Delete architecture from Azure CosmosDB or local fallback"""
@@ -135,27 +246,13 @@ async def delete_architecture(architecture_id: str, user_id: str = "anonymous")
             print(f"Error deleting from CosmosDB, using local fallback: {e}")
     
     # Local fallback
-    items = await load_architectures()
-    updated_items = [item for item in items if item.get("id") != architecture_id]
-    if len(updated_items) < len(items):
-        with open(DATA_PATH, "w") as f:
-            json.dump(updated_items, f, indent=2)
-        return True
-    return False
+    return await _run_local(_delete_local, architecture_id)
 
 async def check_architecture_exists(design_document: str, user_id: str = "anonymous") -> Optional[Dict]:
     """Check if architecture with same design document already exists"""
-    items = await load_architectures(user_id)
-    for item in items:
-        if item.get("design_document") == design_document:
-            return item
-    return None
+    return await _find_by_design(_design_hash(design_document), design_document, user_id)
 
 
 def check_architecture_exists_sync(design_document):
     """Check if an architecture with the same design document already exists (sync version)"""
-    items = load_architectures_sync()
-    for item in items:
-        if item.get("design_document") == design_document:
-            return item
-    return None
+    return _run_sync(check_architecture_exists(design_document))
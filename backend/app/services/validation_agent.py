@@ -1,8 +1,15 @@
 import os
 import re
-import json
 import logging
 import asyncio
+import copy
+import hashlib
+import inspect
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+import orjson
 from dotenv import load_dotenv
 from .azure_credentials import get_azure_ai_projects_client
 
@@ -29,6 +36,135 @@ MCP_BASE_URL = f"http://localhost:{DAPR_PORT}/v1.0/invoke/{DAPR_SERVICE_ID}/meth
 _cached_validation_agent_id = None
 _cached_validation_client = None
 
+# The resolved agent id is also kept on disk so a restarted worker skips the list_agents round trip
+_AGENT_ID_CACHE_PATH = os.getenv("VALIDATION_AGENT_CACHE", "/tmp/validation_agent_id.json")
+_AGENT_ID_CACHE_TTL = int(os.getenv("VALIDATION_AGENT_CACHE_TTL", "86400"))
+
+# Agent validation results by sha256 of (architecture description, diagram code)
+VALIDATION_RESULT_CACHE_TTL = int(os.getenv("VALIDATION_RESULT_CACHE_TTL", "600"))
+_VALIDATION_RESULT_CACHE_MAX = 512
+_validation_result_cache: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+# Validations currently running on the agent, shared by concurrent callers with the same inputs
+_validation_inflight: Dict[str, asyncio.Task] = {}
+
+# System prompt for the validation agent - no tools, pure static analysis only
+_VALIDATION_INSTRUCTIONS = (
+    "You are a Python diagram code validator for Azure architecture diagrams. "
+    "You MUST respond with valid JSON format only. Do NOT execute or test any code. "
+    "Perform static analysis only.\n\n"
+    
+    "**STRICT REQUIREMENTS:**\n"
+    "1. NEVER attempt to run, execute, or import the provided code\n"
+    "2. NEVER mention missing libraries or installation issues\n"
+    "3. ALWAYS respond with valid JSON format only\n"
+    "4. Use static analysis and pattern matching to validate code\n\n"
+    
+    "**ENHANCED VALIDATION CAPABILITIES:**\n"
+    "- Real-time Azure component validation using enhanced_azure_validator.py\n"
+    "- Canonical name resolution (ACR → ContainerRegistries)\n"
+    "- Submodule import validation (compute, web, database, etc.)\n"
+    "- Alias detection and correction\n"
+    "- Component availability checking\n\n"
+    
+    "**Common Import Fixes (apply based on static analysis):**\n"
+    "- ResourceGroup → NOT AVAILABLE (remove completely)\n"
+    "- AppService → AppServices (from diagrams.azure.web)\n"
+    "- KeyVault → KeyVaults (from diagrams.azure.security)\n"
+    "- StaticWebApps → NOT AVAILABLE (use AppServices instead)\n"
+    "- ACR → ContainerRegistries (from diagrams.azure.compute)\n" 
+    "- SqlDatabase → SQLDatabases (from diagrams.azure.database)\n"
+    "- SQLManagedInstance → SQLDatabases (use SQLDatabases instead)\n"
+    "- StorageAccount → StorageAccounts (from diagrams.azure.storage)\n"
+    "- VirtualMachine → VM (from diagrams.azure.compute)\n"
+    "- ContainerInstance → ContainerInstances (from diagrams.azure.compute)\n"
+    "- FunctionApp → FunctionApps (from diagrams.azure.compute)\n"
+    "- LoadBalancer → LoadBalancers (from diagrams.azure.network)\n"
+    "- VirtualNetwork → VirtualNetworks (from diagrams.azure.network)\n"
+    "- CRITICAL: FunctionAppss (double s) → FunctionApps (single s)\n"
+    "- CRITICAL: DataLakes → DataLake (from diagrams.azure.database or storage)\n"
+    "- NEVER use LoadBalancerss (double s) - use LoadBalancers\n"
+    "- NEVER use SQLDatabase (singular) - use SQLDatabases (plural)\n\n"
+    
+    "**MANDATORY JSON Response Format - ALWAYS respond with this exact structure:**\n"
+    "```json\n"
+    "{\n"
+    "  \"is_valid\": true,\n"
+    "  \"validation_score\": 85,\n"
+    "  \"errors\": [\"list of fixed issues\"],\n"
+    "  \"warnings\": [\"list of warnings\"],\n"
+    "  \"suggestions\": [\"list of suggestions\"],\n"
+    "  \"corrected_code\": \"fixed Python code here\",\n"
+    "  \"explanation\": \"brief explanation of changes made\"\n"
+    "}\n"
+    "```\n\n"
+    
+    "CRITICAL: Respond ONLY with valid JSON. No explanatory text before or after."
+)
+
+_VALIDATION_PROMPT_TEMPLATE = """
+Please validate the following Azure architecture diagram code:
+
+**Original Architecture Description:**
+{architecture_description}
+
+**Generated Diagram Code:**
+```python
+{diagram_code}
+```
+
+Please thoroughly validate this code and provide detailed feedback including any necessary corrections.
+"""
+
+# Pulling the JSON out of the agent's reply
+_JSON_FENCE_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+_JSON_TOKEN_RE = re.compile(r'[{}"\\]')
+
+# Exact errors we keep seeing in logs, fixed by auto_fix_common_errors
+_CRITICAL_FIXES = {
+    'FunctionAppss': 'FunctionApps',  # Fix double s
+    'DataLakes': 'DataLake',          # Fix incorrect plural
+    'LoadBalancerss': 'LoadBalancers', # Fix double s
+    'AppServicess': 'AppServices',     # Fix double s
+    'KeyVaultss': 'KeyVaults',         # Fix double s
+    'StorageAccountss': 'StorageAccounts', # Fix double s
+    'SQLDatabasess': 'SQLDatabases',   # Fix double s
+    'ContainerInstancess': 'ContainerInstances', # Fix double s
+    'ContainerRegistriess': 'ContainerRegistries', # Fix double s
+}
+
+# Rewrites applied by auto_fix_common_errors, compiled once
+_API_MANAGEMENT_WEB_IMPORT_RES = (
+    # APIManagement in web imports (with other imports)
+    (re.compile(r'from diagrams\.azure\.web import([^,\n]*),\s*APIManagement([^,\n]*)'), r'from diagrams.azure.web import\1\2'),
+    # APIManagement as sole import from web
+    (re.compile(r'from diagrams\.azure\.web import APIManagement\s*\n'), r''),
+)
+# APIManagement mixed in web imports
+_API_MANAGEMENT_WEB_MIXED_RE = re.compile(r'from diagrams\.azure\.web import(.*)APIManagement(.*)')
+_RESOURCE_GROUP_RES = (
+    # Import lines
+    re.compile(r'from diagrams\.azure\.[\w\.]+ import[^\n]*ResourceGroups?[^\n]*\n?'),
+    # Usage lines
+    re.compile(r'[^\n]*=\s*ResourceGroups?\([^\n]*\n?'),
+    # Connections
+    re.compile(r'\w*[Rr]g\w*\s*>>\s*'),
+    re.compile(r'\s*>>\s*\w*[Rr]g\w*'),
+)
+_DATABASE_IMPORT_RE = re.compile(r'from diagrams\.azure\.database import (.+)')
+_DUPLICATE_SHOW_RES = (
+    re.compile(r'show=True\s*,\s*show=False'),
+    re.compile(r'show=False\s*,\s*show=True'),
+)
+_DIAGRAM_CALL_RE = re.compile(r'with Diagram\(([^)]+)\)')
+
+# Cheap screen for needs_local_fixes: substrings that trigger a fix, plus the
+# hand-maintained component name mistakes as whole words
+_FIX_TRIGGERS = ("APIManagement", "ResourceGroup", "SQLManagedInstance", "show=True") + tuple(_CRITICAL_FIXES)
+_KNOWN_MISTAKES_RE = re.compile(
+    r'\b(?:AppService|KeyVault|StorageAccount|SqlDatabase|SQLDatabase|ACR|ContainerRegistry'
+    r'|VirtualMachines?|FunctionApp|LoadBalancer|DataLakeStorages|ContainerInstance)\b'
+)
+
 
 def get_validation_agents_client():
     """
@@ -55,6 +191,135 @@ def get_validation_agents_client():
         raise Exception(f"Failed to create Azure AI Projects client for validation. Error: {str(e)}")
 
 
+def _load_persisted_agent_id() -> Optional[str]:
+    """Agent id persisted by an earlier process for this endpoint and agent name, if still fresh"""
+    try:
+        with open(_AGENT_ID_CACHE_PATH, 'rb') as f:
+            cached = orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    
+    if (
+        not isinstance(cached, dict)
+        or cached.get("endpoint") != PROJECT_ENDPOINT
+        or cached.get("name") != VALIDATION_AGENT_NAME
+        or time.time() - cached.get("ts", 0) > _AGENT_ID_CACHE_TTL
+    ):
+        return None
+    return cached.get("id")
+
+
+def _persist_agent_id(agent_id: str):
+    """Write the agent id for later processes; failing to persist it is not an error"""
+    tmp_path = _AGENT_ID_CACHE_PATH + ".tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps({"endpoint": PROJECT_ENDPOINT, "name": VALIDATION_AGENT_NAME, "id": agent_id, "ts": time.time()}))
+        os.replace(tmp_path, _AGENT_ID_CACHE_PATH)
+    except OSError as e:
+        logger.debug(f"Could not persist validation agent id: {e}")
+
+
+def _forget_validation_agent_id():
+    """Drop the cached agent id in memory and on disk, so the next lookup resolves it again"""
+    global _cached_validation_agent_id
+    _cached_validation_agent_id = None
+    try:
+        os.remove(_AGENT_ID_CACHE_PATH)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"⚠️ Could not remove persisted validation agent id: {e}")
+
+
+# Markers of a run error caused by an agent id that no longer exists
+_MISSING_AGENT_MARKERS = ("not found", "not_found", "notfound", "invalid_agent", "invalid agent", "no assistant found")
+
+
+def _is_missing_agent_error(error) -> bool:
+    """Whether a run exception or run last_error says the agent no longer exists"""
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status_code == 404:
+        return True
+    text = f"{error} {getattr(response, 'text', '')}".lower()
+    return any(marker in text for marker in _MISSING_AGENT_MARKERS)
+
+
+async def _maybe_await(value):
+    """Resolve a client call that returns a result directly (sync SDK) or an awaitable (async SDK)"""
+    return await value if inspect.isawaitable(value) else value
+
+
+async def _first_item(items):
+    """First item of a list, sync pager or async pager, or None if empty"""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            return item
+        return None
+    return next(iter(items), None)
+
+
+def _extract_last_json_object(text: str) -> Optional[str]:
+    """
+    Last top-level {...} block in text, found in one left-to-right pass over the brace,
+    quote and backslash characters (braces inside JSON strings don't count)
+    """
+    last_span = None
+    depth = 0
+    start = 0
+    in_string = False
+    skip_to = 0
+    for match in _JSON_TOKEN_RE.finditer(text):
+        index = match.start()
+        if index < skip_to:
+            continue
+        char = match.group()
+        if in_string:
+            if char == '\\':
+                skip_to = index + 2  # escaped character
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = depth > 0
+        elif char == '{':
+            if depth == 0:
+                start = index
+            depth += 1
+        elif char == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                last_span = (start, index + 1)
+    
+    return text[last_span[0]:last_span[1]] if last_span else None
+
+
+def _validation_cache_key(architecture_description: str, diagram_code: str) -> str:
+    return hashlib.sha256((architecture_description + "\x00" + diagram_code).encode("utf-8")).hexdigest()
+
+
+def _cached_validation_result(key: str) -> Optional[dict]:
+    entry = _validation_result_cache.get(key)
+    if entry is None:
+        return None
+    
+    timestamp, validation_result = entry
+    if time.monotonic() - timestamp > VALIDATION_RESULT_CACHE_TTL:
+        del _validation_result_cache[key]
+        return None
+    
+    _validation_result_cache.move_to_end(key)
+    # Callers may modify the result, so never hand out the cached dict itself
+    return copy.deepcopy(validation_result)
+
+
+def _cache_validation_result(key: str, validation_result: dict):
+    _validation_result_cache[key] = (time.monotonic(), copy.deepcopy(validation_result))
+    _validation_result_cache.move_to_end(key)
+    while len(_validation_result_cache) > _VALIDATION_RESULT_CACHE_MAX:
+        _validation_result_cache.popitem(last=False)
+
+
 async def get_or_create_validation_agent():
     """
     Get or create the validation agent
@@ -64,15 +329,17 @@ async def get_or_create_validation_agent():
     if _cached_validation_agent_id:
         return _cached_validation_agent_id
     
+    persisted_agent_id = _load_persisted_agent_id()
+    if persisted_agent_id:
+        _cached_validation_agent_id = persisted_agent_id
+        logger.info(f"Using persisted validation agent: {persisted_agent_id}")
+        return persisted_agent_id
+    
     try:
         agents_client = get_validation_agents_client()
         
         # Check for existing agent
-        existing_agents_task = agents_client.list_agents()
-        if asyncio.iscoroutine(existing_agents_task):
-            existing_agents = await existing_agents_task
-        else:
-            existing_agents = existing_agents_task
+        existing_agents = await _maybe_await(agents_client.list_agents())
             
         for agent in existing_agents:
             # Handle both object and dictionary formats
@@ -81,6 +348,7 @@ async def get_or_create_validation_agent():
             
             if agent_name == VALIDATION_AGENT_NAME and agent_id:
                 _cached_validation_agent_id = agent_id
+                _persist_agent_id(agent_id)
                 logger.info(f"Found existing validation agent: {agent_id}")
                 return agent_id
     except Exception as e:
@@ -91,76 +359,20 @@ async def get_or_create_validation_agent():
         logger.info(f"Creating new validation agent: {VALIDATION_AGENT_NAME}")
         agents_client = get_validation_agents_client()
         
-        # No tools needed - pure static analysis only
-        instructions = (
-            "You are a Python diagram code validator for Azure architecture diagrams. "
-            "You MUST respond with valid JSON format only. Do NOT execute or test any code. "
-            "Perform static analysis only.\n\n"
-            
-            "**STRICT REQUIREMENTS:**\n"
-            "1. NEVER attempt to run, execute, or import the provided code\n"
-            "2. NEVER mention missing libraries or installation issues\n"
-            "3. ALWAYS respond with valid JSON format only\n"
-            "4. Use static analysis and pattern matching to validate code\n\n"
-            
-            "**ENHANCED VALIDATION CAPABILITIES:**\n"
-            "- Real-time Azure component validation using enhanced_azure_validator.py\n"
-            "- Canonical name resolution (ACR → ContainerRegistries)\n"
-            "- Submodule import validation (compute, web, database, etc.)\n"
-            "- Alias detection and correction\n"
-            "- Component availability checking\n\n"
-            
-            "**Common Import Fixes (apply based on static analysis):**\n"
-            "- ResourceGroup → NOT AVAILABLE (remove completely)\n"
-            "- AppService → AppServices (from diagrams.azure.web)\n"
-            "- KeyVault → KeyVaults (from diagrams.azure.security)\n"
-            "- StaticWebApps → NOT AVAILABLE (use AppServices instead)\n"
-            "- ACR → ContainerRegistries (from diagrams.azure.compute)\n" 
-            "- SqlDatabase → SQLDatabases (from diagrams.azure.database)\n"
-            "- SQLManagedInstance → SQLDatabases (use SQLDatabases instead)\n"
-            "- StorageAccount → StorageAccounts (from diagrams.azure.storage)\n"
-            "- VirtualMachine → VM (from diagrams.azure.compute)\n"
-            "- ContainerInstance → ContainerInstances (from diagrams.azure.compute)\n"
-            "- FunctionApp → FunctionApps (from diagrams.azure.compute)\n"
-            "- LoadBalancer → LoadBalancers (from diagrams.azure.network)\n"
-            "- VirtualNetwork → VirtualNetworks (from diagrams.azure.network)\n"
-            "- CRITICAL: FunctionAppss (double s) → FunctionApps (single s)\n"
-            "- CRITICAL: DataLakes → DataLake (from diagrams.azure.database or storage)\n"
-            "- NEVER use LoadBalancerss (double s) - use LoadBalancers\n"
-            "- NEVER use SQLDatabase (singular) - use SQLDatabases (plural)\n\n"
-            
-            "**MANDATORY JSON Response Format - ALWAYS respond with this exact structure:**\n"
-            "```json\n"
-            "{\n"
-            "  \"is_valid\": true,\n"
-            "  \"validation_score\": 85,\n"
-            "  \"errors\": [\"list of fixed issues\"],\n"
-            "  \"warnings\": [\"list of warnings\"],\n"
-            "  \"suggestions\": [\"list of suggestions\"],\n"
-            "  \"corrected_code\": \"fixed Python code here\",\n"
-            "  \"explanation\": \"brief explanation of changes made\"\n"
-            "}\n"
-            "```\n\n"
-            
-            "CRITICAL: Respond ONLY with valid JSON. No explanatory text before or after."
-        )
 
         # Try creating agent without tools (static analysis only)
-        create_agent_task = agents_client.create_agent(
+        agent = await _maybe_await(agents_client.create_agent(
             model=MODEL_NAME,
             name=VALIDATION_AGENT_NAME,
-            instructions=instructions
+            instructions=_VALIDATION_INSTRUCTIONS
             # No tools specified - static analysis only
-        )
-        
-        if asyncio.iscoroutine(create_agent_task):
-            agent = await create_agent_task
-        else:
-            agent = create_agent_task
+        ))
         
         # Handle both object and dictionary formats for the created agent
         agent_id = agent.get("id") if isinstance(agent, dict) else getattr(agent, "id", None)
         _cached_validation_agent_id = agent_id
+        if agent_id:
+            _persist_agent_id(agent_id)
         logger.info(f"Created new validation agent: {agent_id}")
         return agent_id
     except Exception as e:
@@ -180,13 +392,56 @@ async def validate_diagram_code(architecture_description: str, diagram_code: str
     Returns:
         dict: Validation results with corrections if needed
     """
-    # First try local validation as a fallback
-    local_result = local_validate_diagram_code(diagram_code)
+    # The agent answers the same inputs the same way, so repeat validations skip it entirely
+    cache_key = _validation_cache_key(architecture_description, diagram_code)
+    cached_result = _cached_validation_result(cache_key)
+    if cached_result is not None:
+        logger.info("✅ Using cached validation result")
+        return cached_result
+    
+    task = _validation_inflight.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(_run_validation(architecture_description, diagram_code, cache_key))
+        _validation_inflight[cache_key] = task
+        task.add_done_callback(lambda _: _validation_inflight.pop(cache_key, None))
+    else:
+        logger.info("⏳ Joining in-flight validation of the same code")
+    
+    # Shield so one cancelled caller doesn't cancel the validation for everyone else;
+    # each caller gets its own copy of the result
+    return copy.deepcopy(await asyncio.shield(task))
+
+
+async def _run_validation_agent(agents_client, thread_id: str, agent_id: str):
+    """Run the agent on the thread, resolving the agent id again once if it no longer exists"""
+    try:
+        run = await _maybe_await(agents_client.runs.create_and_process(thread_id=thread_id, agent_id=agent_id))
+    except Exception as e:
+        if not _is_missing_agent_error(e):
+            raise
+        error = e
+    else:
+        run_status = run.get("status") if isinstance(run, dict) else getattr(run, "status", "unknown")
+        error = run.get("last_error") if isinstance(run, dict) else getattr(run, "last_error", None)
+        if run_status != "failed" or not error or not _is_missing_agent_error(error):
+            return run
     
+    # The agent was deleted or recreated since its id was cached
+    logger.warning(f"⚠️ Validation agent {agent_id} is no longer available ({error}), resolving it again")
+    _forget_validation_agent_id()
+    agent_id = await get_or_create_validation_agent()
+    logger.info(f"Using validation agent: {agent_id}")
+    return await _maybe_await(agents_client.runs.create_and_process(thread_id=thread_id, agent_id=agent_id))
+
+
+async def _run_validation(architecture_description: str, diagram_code: str, cache_key: str) -> dict:
+    """Validate with the agent, falling back to local validation"""
+    # Local validation is only the fallback, so it runs only when the agent can't answer
     if not PROJECT_ENDPOINT:
         logger.warning("PROJECT_ENDPOINT not configured, using local validation only")
-        return local_result
+        return local_validate_diagram_code(diagram_code)
     
+    thread_id = None
     try:
         agents_client = get_validation_agents_client()
         agent_id = await get_or_create_validation_agent()
@@ -194,49 +449,27 @@ async def validate_diagram_code(architecture_description: str, diagram_code: str
         logger.info(f"Using validation agent: {agent_id}")
         
         # Create a thread for validation
-        thread_task = agents_client.threads.create()
-        if asyncio.iscoroutine(thread_task):
-            thread = await thread_task
-        else:
-            thread = thread_task
+        thread = await _maybe_await(agents_client.threads.create())
             
         thread_id = thread.get("id") if isinstance(thread, dict) else getattr(thread, "id", None)
         logger.info(f"Created validation thread: {thread_id}")
         
-        validation_prompt = f"""
-Please validate the following Azure architecture diagram code:
-
-**Original Architecture Description:**
-{architecture_description}
-
-**Generated Diagram Code:**
-```python
-{diagram_code}
-```
-
-Please thoroughly validate this code and provide detailed feedback including any necessary corrections.
-"""
+        validation_prompt = _VALIDATION_PROMPT_TEMPLATE.format(
+            architecture_description=architecture_description,
+            diagram_code=diagram_code
+        )
         
         # Add validation message
-        message_task = agents_client.messages.create(
+        await _maybe_await(agents_client.messages.create(
             thread_id=thread_id,
             role="user",
             content=validation_prompt
-        )
-        
-        if asyncio.iscoroutine(message_task):
-            await message_task
-        else:
-            pass  # Message created
+        ))
         
         # Run validation
         logger.info("Starting validation...")
         
-        run_task = agents_client.runs.create_and_process(thread_id=thread_id, agent_id=agent_id)
-        if asyncio.iscoroutine(run_task):
-            run = await run_task
-        else:
-            run = run_task
+        run = await _run_validation_agent(agents_client, thread_id, agent_id)
             
         run_status = run.get("status") if isinstance(run, dict) else getattr(run, "status", "unknown")
         logger.info(f"Validation completed with status: {run_status}")
@@ -246,16 +479,13 @@ Please thoroughly validate this code and provide detailed feedback including any
             error_msg = f"Validation run failed: {last_error}"
             logger.error(error_msg)
             logger.info("Falling back to local validation...")
-            return local_result
+            return local_validate_diagram_code(diagram_code)
         
-        # Get validation response
-        messages_task = agents_client.messages.list(thread_id=thread_id, order="desc")
-        if asyncio.iscoroutine(messages_task):
-            messages = await messages_task
-        else:
-            messages = list(messages_task)
+        # Get only the newest message - the thread is single-use, so that is the assistant reply
+        messages = await _maybe_await(agents_client.messages.list(thread_id=thread_id, order="desc", limit=1))
+        message = await _first_item(messages)
         
-        for message in messages:
+        if message is not None:
             message_role = message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
             message_content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
             
@@ -268,7 +498,7 @@ Please thoroughly validate this code and provide detailed feedback including any
                     
                     # Extract JSON from markdown code blocks if present
                     if "```json" in response_clean:
-                        json_match = re.search(r'```json\s*(.*?)\s*```', response_clean, re.DOTALL)
+                        json_match = _JSON_FENCE_RE.search(response_clean)
                         if json_match:
                             response_clean = json_match.group(1)
                     
@@ -278,13 +508,12 @@ Please thoroughly validate this code and provide detailed feedback including any
                         pass
                     else:
                         # Try to find JSON-like content in the response
-                        json_pattern = r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}'
-                        json_matches = re.findall(json_pattern, response_clean, re.DOTALL)
-                        if json_matches:
-                            response_clean = json_matches[-1]  # Use the last (likely most complete) JSON
+                        json_object = _extract_last_json_object(response_clean)
+                        if json_object:
+                            response_clean = json_object  # Use the last (likely most complete) JSON
                     
                     # Try to parse as JSON
-                    validation_result = json.loads(response_clean)
+                    validation_result = orjson.loads(response_clean)
                     
                     # Ensure all required fields are present
                     required_fields = ["is_valid", "validation_score", "errors", "warnings", "suggestions", "corrected_code", "explanation"]
@@ -311,9 +540,10 @@ Please thoroughly validate this code and provide detailed feedback including any
                             validation_result['corrected_code'] = corrected
                             validation_result['explanation'] += " | Auto-fixed common import errors"
                     
+                    _cache_validation_result(cache_key, validation_result)
                     return validation_result
                         
-                except json.JSONDecodeError as je:
+                except orjson.JSONDecodeError as je:
                     logger.warning(f"⚠️ Could not parse validation response as JSON: {je}")
                     logger.debug(f"Raw response: {response[:500]}...")
                     
@@ -336,12 +566,19 @@ Please thoroughly validate this code and provide detailed feedback including any
         
         # No response found - fall back to local validation
         logger.warning("❌ No validation response received - using local validation")
-        return local_result
+        return local_validate_diagram_code(diagram_code)
             
     except Exception as e:
         logger.error(f"❌ Agent validation failed: {e}")
         logger.info("Falling back to local validation...")
-        return local_result
+        return local_validate_diagram_code(diagram_code)
+    finally:
+        # Threads are single-use, so don't leave them accumulating on the service
+        if thread_id:
+            try:
+                await _maybe_await(agents_client.threads.delete(thread_id))
+            except Exception as e:
+                logger.warning(f"⚠️ Could not delete validation thread {thread_id}: {e}")
 
 
 def local_validate_diagram_code(diagram_code: str) -> dict:
@@ -404,19 +641,21 @@ def extract_message_content(content) -> str:
     if isinstance(content, str):
         return content.strip()
     elif isinstance(content, list):
-        combined_text = ""
+        # Collect the pieces and join once instead of growing a string per item
+        parts: list[str] = []
         for item in content:
             if isinstance(item, dict):
                 if item.get("type") == "text":
                     text_obj = item.get("text", {})
                     if isinstance(text_obj, dict) and "value" in text_obj:
-                        combined_text += text_obj["value"]
+                        parts.append(text_obj["value"])
                     elif isinstance(text_obj, str):
-                        combined_text += text_obj
-            elif hasattr(item, 'type') and hasattr(item, 'text'):
-                if item.type == "text" and hasattr(item.text, 'value'):
-                    combined_text += item.text.value
-        return combined_text.strip()
+                        parts.append(text_obj)
+            else:
+                text_obj = getattr(item, 'text', None)
+                if text_obj is not None and getattr(item, 'type', None) == "text" and hasattr(text_obj, 'value'):
+                    parts.append(text_obj.value)
+        return "".join(parts).strip()
     else:
         return str(content).strip()
 
@@ -456,13 +695,20 @@ def fix_duplicate_kwargs(code: str) -> str:
     return re.sub(function_pattern, fix_params, code)
 
 
-def auto_fix_common_errors(code: str) -> str:
-    """Auto-fix common import errors in diagram code using validated Azure data"""
-    import re
-    import json
-    import os
-    
-    # Load our validated Azure component data
+def needs_local_fixes(code: str) -> bool:
+    """
+    Cheap check for whether auto_fix_common_errors has anything obvious to fix.
+    Component names outside the hand-maintained list are still caught by MCP validation.
+    """
+    if any(trigger in code for trigger in _FIX_TRIGGERS):
+        return True
+    if 'with Diagram(' in code and 'show=False' not in code:
+        return True
+    return _KNOWN_MISTAKES_RE.search(code) is not None
+
+
+def _azure_nodes_path() -> str:
+    """Locate azure_nodes.json"""
     # First try the container path where it's copied
     azure_nodes_path = os.path.join(os.path.dirname(__file__), "..", "..", "..", "azure_nodes.json")
     if not os.path.exists(azure_nodes_path):
@@ -476,16 +722,25 @@ def auto_fix_common_errors(code: str) -> str:
             if os.path.exists(path):
                 azure_nodes_path = path
                 break
+    return azure_nodes_path
+
+
+@lru_cache(maxsize=1)
+def _load_azure_data() -> Optional[Dict[str, str]]:
+    """
+    Load the validated Azure component data once and derive the auto-fix lookup table
     
+    Returns:
+        dict: common mistake -> canonical name, or None if the data could not be loaded
+    """
     try:
-        with open(azure_nodes_path, 'r', encoding='utf-8') as f:
-            azure_data = json.load(f)
+        with open(_azure_nodes_path(), 'rb') as f:
+            azure_data = orjson.loads(f.read())
     except Exception as e:
         logger.warning(f"⚠️ Could not load Azure data, falling back to regex fixes: {e}")
-        return auto_fix_common_errors_regex(code)
+        return None
     
     # Build lookup tables from our validated data
-    canonical_map = {}  # canonical_name -> (submodule, class_info)
     common_mistakes = {}  # common_mistake -> canonical_name
     
     for submodule, components in azure_data.items():
@@ -496,8 +751,6 @@ def auto_fix_common_errors(code: str) -> str:
             if canonical.startswith('_'):
                 continue
             
-            canonical_map[canonical] = (submodule, comp)
-            
             # Build common mistake patterns
             # AppService -> AppServices
             if canonical.endswith('s') and len(canonical) > 1:
@@ -539,50 +792,66 @@ def auto_fix_common_errors(code: str) -> str:
                 common_mistakes["ContainerInstance"] = canonical
                 common_mistakes["ContainerInstancess"] = canonical  # Fix double s
     
+    return common_mistakes
+
+
+@lru_cache(maxsize=1)
+def _mistake_fixes() -> Optional[Tuple[Dict[str, str], "re.Pattern[str]", Tuple[str, ...]]]:
+    """
+    Merge the data-driven mistakes with the critical fixes into one whole-word alternation
+    
+    Returns:
+        tuple: (mistake -> correct name, compiled pattern, pre-scan keys), or None if the
+        Azure data could not be loaded
+    """
+    common_mistakes = _load_azure_data()
+    if common_mistakes is None:
+        return None
+    
+    # The data-driven correction wins when both tables know a mistake
+    mistake_map = {**_CRITICAL_FIXES, **common_mistakes}
+    # Longest first, so a mistake is never shadowed by one of its prefixes
+    alternation = '|'.join(map(re.escape, sorted(mistake_map, key=len, reverse=True)))
+    # Substring pre-scan keys: a mistake containing another one can only be present if
+    # the shorter one is too, so only the minimal keys need checking
+    mistake_keys = tuple(
+        mistake for mistake in mistake_map
+        if not any(other != mistake and other in mistake for other in mistake_map)
+    )
+    return mistake_map, re.compile(r'\b(' + alternation + r')\b'), mistake_keys
+
+
+def auto_fix_common_errors(code: str) -> str:
+    """Auto-fix common import errors in diagram code using validated Azure data"""
+    # Lookup tables built from our validated Azure component data (loaded once per process)
+    mistake_fixes = _mistake_fixes()
+    if mistake_fixes is None:
+        return auto_fix_common_errors_regex(code)
+    mistake_map, mistake_re, mistake_keys = mistake_fixes
+    
     logger.info("🔧 Using data-driven component validation for auto-fix...")
     
-    fixed_code = code
     fixes_applied = []
     
-    # Fix common component name mistakes using our lookup table
-    for mistake, correct in common_mistakes.items():
-        if mistake in fixed_code:
-            # Only replace if it's used as a component (not just a substring)
-            pattern = r'\b' + re.escape(mistake) + r'\b'
-            if re.search(pattern, fixed_code):
-                fixed_code = re.sub(pattern, correct, fixed_code)
-                fixes_applied.append(f"Fixed component: {mistake} -> {correct}")
-    
-    # CRITICAL: Add specific fixes for the exact errors we're seeing in logs
-    critical_fixes = {
-        'FunctionAppss': 'FunctionApps',  # Fix double s
-        'DataLakes': 'DataLake',          # Fix incorrect plural
-        'LoadBalancerss': 'LoadBalancers', # Fix double s
-        'AppServicess': 'AppServices',     # Fix double s
-        'KeyVaultss': 'KeyVaults',         # Fix double s
-        'StorageAccountss': 'StorageAccounts', # Fix double s
-        'SQLDatabasess': 'SQLDatabases',   # Fix double s
-        'ContainerInstancess': 'ContainerInstances', # Fix double s
-        'ContainerRegistriess': 'ContainerRegistries', # Fix double s
-    }
+    # Fix common component name mistakes and the exact errors we keep seeing in logs in one pass
+    # (skipped when plain substring checks find none of them, which is the common case)
+    fixed_code = code
+    if any(mistake in code for mistake in mistake_keys):
+        fixed_mistakes = {}
+        
+        def _fix_mistake(match):
+            mistake = match.group(1)
+            fixed_mistakes[mistake] = mistake_map[mistake]
+            return mistake_map[mistake]
+        
+        fixed_code = mistake_re.sub(_fix_mistake, code)
+        fixes_applied.extend(f"Fixed component: {mistake} -> {correct}" for mistake, correct in fixed_mistakes.items())
     
     # CRITICAL FIX: APIManagement import error (from logs) - Multiple patterns
     if 'APIManagement' in fixed_code:
-        # Pattern 1: APIManagement in web imports (with other imports)
-        fixed_code = re.sub(
-            r'from diagrams\.azure\.web import([^,\n]*),\s*APIManagement([^,\n]*)',
-            r'from diagrams.azure.web import\1\2',
-            fixed_code
-        )
-        # Pattern 2: APIManagement as sole import from web
-        fixed_code = re.sub(
-            r'from diagrams\.azure\.web import APIManagement\s*\n',
-            r'',
-            fixed_code
-        )
-        # Pattern 3: APIManagement mixed in web imports
-        fixed_code = re.sub(
-            r'from diagrams\.azure\.web import(.*)APIManagement(.*)',
+        for pattern, replacement in _API_MANAGEMENT_WEB_IMPORT_RES:
+            fixed_code = pattern.sub(replacement, fixed_code)
+        fixed_code = _API_MANAGEMENT_WEB_MIXED_RE.sub(
             lambda m: f'from diagrams.azure.web import{m.group(1)}{m.group(2)}'.replace(', ,', ',').strip(', '),
             fixed_code
         )
@@ -603,36 +872,19 @@ def auto_fix_common_errors(code: str) -> str:
             fixed_code = '\n'.join(import_lines + other_lines)
             fixes_applied.append("CRITICAL FIX: Moved APIManagement from azure.web to azure.integration")
     
-    for mistake, correct in critical_fixes.items():
-        if mistake in fixed_code:
-            # Word boundary replacement to avoid partial matches
-            pattern = r'\b' + re.escape(mistake) + r'\b'
-            if re.search(pattern, fixed_code):
-                fixed_code = re.sub(pattern, correct, fixed_code)
-                fixes_applied.append(f"CRITICAL FIX: {mistake} -> {correct}")
-    
     # Remove ResourceGroup entirely (not available in diagrams)
     if 'ResourceGroup' in fixed_code:
-        # Remove import lines
-        fixed_code = re.sub(r'from diagrams\.azure\.[\w\.]+ import[^\n]*ResourceGroups?[^\n]*\n?', '', fixed_code)
-        # Remove usage lines
-        fixed_code = re.sub(r'[^\n]*=\s*ResourceGroups?\([^\n]*\n?', '', fixed_code)
-        # Remove from connections
-        fixed_code = re.sub(r'\w*[Rr]g\w*\s*>>\s*', '', fixed_code)
-        fixed_code = re.sub(r'\s*>>\s*\w*[Rr]g\w*', '', fixed_code)
+        for pattern in _RESOURCE_GROUP_RES:
+            fixed_code = pattern.sub('', fixed_code)
         fixes_applied.append("Removed ResourceGroup references (not available)")
     
     # Fix SQLManagedInstance (not available - use SQLDatabases)
     if 'SQLManagedInstance' in fixed_code:
-        fixed_code = re.sub(r'SQLManagedInstance', 'SQLDatabases', fixed_code)
+        fixed_code = fixed_code.replace('SQLManagedInstance', 'SQLDatabases')
         # Ensure correct import
         if 'from diagrams.azure.database import' in fixed_code:
             if 'SQLDatabases' not in fixed_code:
-                fixed_code = re.sub(
-                    r'from diagrams\.azure\.database import (.+)',
-                    r'from diagrams.azure.database import \1, SQLDatabases',
-                    fixed_code
-                )
+                fixed_code = _DATABASE_IMPORT_RE.sub(r'from diagrams.azure.database import \1, SQLDatabases', fixed_code)
         else:
             # Add the import
             lines = fixed_code.split('\n')
@@ -645,14 +897,13 @@ def auto_fix_common_errors(code: str) -> str:
     
     # Fix duplicate 'show' parameters in Diagram constructor
     if 'show=True, show=False' in fixed_code or 'show=True,show=False' in fixed_code:
-        fixed_code = re.sub(r'show=True\s*,\s*show=False', 'show=False', fixed_code)
-        fixed_code = re.sub(r'show=False\s*,\s*show=True', 'show=False', fixed_code)
+        for pattern in _DUPLICATE_SHOW_RES:
+            fixed_code = pattern.sub('show=False', fixed_code)
         fixes_applied.append("Fixed duplicate show parameters")
     
     # Ensure show=False is present if missing
     if 'with Diagram(' in fixed_code and 'show=False' not in fixed_code and 'show=True' not in fixed_code:
-        fixed_code = re.sub(
-            r'with Diagram\(([^)]+)\)',
+        fixed_code = _DIAGRAM_CALL_RE.sub(
             lambda m: f'with Diagram({m.group(1).rstrip()}, show=False)',
             fixed_code
         )
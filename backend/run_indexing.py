@@ -101,13 +101,20 @@ async def main():
     except Exception as e:
         print(f"\n❌ Indexing failed with error: {e}")
         return False
+    finally:
+        await indexer.aclose()
 
 if __name__ == "__main__":
     # Change to the script directory
     os.chdir(Path(__file__).parent)
     
-    # Run the indexing process
-    success = asyncio.run(main())
+    # Run the indexing process (on uvloop where available; it's IO-bound end to end)
+    try:
+        import uvloop
+        run = uvloop.run
+    except ImportError:
+        run = asyncio.run
+    success = run(main())
     
     # Exit with appropriate code
     sys.exit(0 if success else 1)
\ No newline at end of file
@@ -133,6 +133,13 @@ class MCPServerManager:
                 
                 # Call the search function
                 results = mcp_microsoft_doc_microsoft_docs_search(query=query)
+                
+                # Optionally trim snippets so callers don't pay for content they will cut anyway
+                max_snippet_chars = arguments.get("max_snippet_chars")
+                if max_snippet_chars and isinstance(results, list):
+                    for doc in results:
+                        if isinstance(doc, dict) and isinstance(doc.get("content"), str):
+                            doc["content"] = doc["content"][:max_snippet_chars]
                 return {"content": results}
                 
             elif tool == "microsoft_docs_fetch":